@@ -1,51 +1,1139 @@
-import tkinter as tk
-from tkinter import scrolledtext, END
 import os
 import sys
 import argparse
+import asyncio
 import csv
+import io
+import json
 import base64
+import bisect
+import codecs
+import contextlib
+import mmap
+import select
+import signal
+import socket
+import sqlite3
+import struct
+import tempfile
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from types import MappingProxyType
 from pathlib import Path
 import datetime
+import fnmatch
+import threading
+import time
+
+# То же, что tkinter.END: сам tkinter импортируется только в графическом режиме
+END = 'end'
+# Бюджет кэша декодированного содержимого файлов (в байтах)
+DEFAULT_CONTENT_CACHE_BYTES = 64 * 1024 * 1024
+# Содержимое файлов начиная с этого размера (в base64) при загрузке CSV уходит
+# в отображаемый в память файл-хранилище, а не держится в памяти процесса
+DEFAULT_STORE_MIN_BYTES = 1024 * 1024
+# Размер порции при потоковом чтении файлов (cat, read_file_chunks)
+READ_CHUNK_SIZE = 64 * 1024
+# CSV меньше этого размера всегда грузится в одном процессе: запуск пула дороже самой загрузки
+PARALLEL_LOAD_MIN_BYTES = 32 * 1024 * 1024
+# Журнал изменений: записи сбрасываются на диск группой, когда их накопилось
+# JOURNAL_GROUP_RECORDS или с первой несброшенной прошло JOURNAL_GROUP_MS.
+# После JOURNAL_COMPACT_RECORDS записей журнал переписывается по текущему состоянию
+JOURNAL_GROUP_RECORDS = 256
+JOURNAL_GROUP_MS = 200
+JOURNAL_COMPACT_RECORDS = 100000
+# Как часто (мс) проверять, не изменился ли CSV при --watch
+RELOAD_POLL_MS = 1000
+# Максимальное число путей в кэше поиска узлов
+DEFAULT_PATH_CACHE_SIZE = 4096
+# Максимальная задержка вывода в окно (мс): весь текст за этот интервал вставляется одной операцией
+DEFAULT_OUTPUT_LATENCY_MS = 16
+# Число строк, которое хранит окно вывода (0 - без ограничения).
+# Старые строки удаляются пачкой, когда лимит превышен на SCROLLBACK_SLACK
+DEFAULT_SCROLLBACK_LINES = 10000
+SCROLLBACK_SLACK = 0.1
+# Сколько миллисекунд за один тик цикла Tk тратится на выполнение строк скрипта
+DEFAULT_SCRIPT_SLICE_MS = 10
+# Пока команда выполняется в фоне, окно раз в FRAME_MS обрабатывает цикл asyncio и выводит накопленный текст
+FRAME_MS = 16
+# Сколько секунд может выполняться команда в графическом режиме (0 - без ограничения)
+DEFAULT_COMMAND_TIMEOUT_S = 60
+# Через сколько узлов долгие обходы VFS (find, chown -R) проверяют, не прервана ли команда
+INTERRUPT_CHECK_NODES = 4096
+# Сервер VFS (--serve): сколько команд сеансов выполняется одновременно и как часто
+# клиент, ожидая ответа, проверяет, не нажат ли Ctrl-C
+DEFAULT_SERVER_WORKERS = 8
+REMOTE_POLL_S = 0.1
+# Сколько вариантов дополнения по Tab показывать
+COMPLETION_LIMIT = 100
+
+# Бинарный образ VFS: заголовок, таблица узлов, таблица строк, область содержимого.
+# Дети каждой директории лежат в таблице узлов подряд, корень - узел 0.
+IMAGE_MAGIC = b'VFSIMG01'
+IMAGE_HEADER = struct.Struct('<8sIQQQQ')  # magic, число узлов, смещение/размер строк, смещение/размер содержимого
+IMAGE_NODE = struct.Struct('<IIB3xIIQQ')  # имя (смещение, длина), флаги, первый ребенок, число детей, содержимое (смещение, длина)
+IMAGE_FLAG_DIRECTORY = 1
+
+# Общий неизменяемый словарь детей для всех пустых директорий,
+# собственный dict создается при добавлении первого ребенка (VFS.attach)
+EMPTY_CHILDREN = MappingProxyType({})
 
 class VFSNode:
+    # __slots__ вместо __dict__ экономит больше половины памяти на узел
+    __slots__ = ('name', 'is_directory', 'content', 'encoded', 'source', 'extent', 'children', 'parent', 'uid', 'gid')
+    
     def __init__(self, name, is_directory=False, content=None):
         self.name = name
         self.is_directory = is_directory
         self.content = content  # для файлов
-        self.children = {} if is_directory else None  # для директорий
+        self.encoded = None  # сырое base64-содержимое из CSV, декодируется при первом чтении
+        self.source = None  # индекс узла в бинарном образе, если узел построен из него
+        self.extent = None  # (хранилище, смещение, длина) содержимого в отображаемом в память файле
+        self.children = EMPTY_CHILDREN if is_directory else None  # для директорий
         self.parent = None
-        self.owner = "root"  # по умолчанию
-        self.group = "root"  # по умолчанию
+        # Владелец и группа - номера в таблицах VFS.users/VFS.groups, 0 - root
+        self.uid = 0
+        self.gid = 0
+
+class IdTable:
+    """Таблица имен пользователей или групп: имя <-> небольшой целый номер"""
+    def __init__(self):
+        self.names = ['root']
+        self.ids = {'root': 0}
+    
+    def id_of(self, name):
+        """Возвращает номер имени, при необходимости добавляя его в таблицу"""
+        id_ = self.ids.get(name)
+        if id_ is None:
+            id_ = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return id_
+    
+    def name_of(self, id_):
+        return self.names[id_]
+
+def decode_content(encoded):
+    """Декодирует base64-содержимое файла, при ошибке возвращает его как есть"""
+    if not encoded.isascii():
+        return encoded.decode('utf-8')  # base64 только ASCII; b64decode молча отбросил бы остальные байты
+    try:
+        return base64.b64decode(encoded).decode('utf-8')
+    except ValueError:
+        return encoded.decode('utf-8')
+
+class ContentCache:
+    """LRU-кэш декодированного содержимого с ограничением по объему в байтах"""
+    def __init__(self, max_bytes=DEFAULT_CONTENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()  # node -> (content, size)
+    
+    def get(self, node):
+        entry = self.entries.get(node)
+        if entry is None:
+            return None
+        self.entries.move_to_end(node)
+        return entry[0]
+    
+    def put(self, node, content, size):
+        if size > self.max_bytes:
+            return  # слишком большой файл не кэшируем, чтобы не вытеснить весь кэш
+        self.discard(node)
+        self.entries[node] = (content, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, old_size) = self.entries.popitem(last=False)
+            self.current_bytes -= old_size
+    
+    def discard(self, node):
+        entry = self.entries.pop(node, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+def parse_csv_shard(csv_path, start, end, columns):
+    """Разбирает строки CSV в байтовом диапазоне [start, end) - выполняется в процессе пула.
+    
+    Файл без кавычек, поэтому поля просто разделены запятыми. Содержимое файлов
+    не передается обратно: возвращается (путь, директория ли, смещение, длина)
+    """
+    path_index, type_index, content_index = columns
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    rows = []
+    line_start = start
+    for line in data.split(b'\n'):
+        next_start = line_start + len(line) + 1
+        line = line.rstrip(b'\r')
+        if line:
+            fields = line.split(b',')
+            row_type = fields[type_index] if type_index < len(fields) else None
+            content_offset = content_length = 0
+            if content_index is not None and content_index < len(fields):
+                content_offset = line_start + sum(len(field) + 1 for field in fields[:content_index])
+                content_length = len(fields[content_index])
+            rows.append((fields[path_index].decode('utf-8'), row_type == b'directory' or row_type == b'folder',
+                         content_offset, content_length))
+        line_start = next_start
+    return rows
+
+def split_csv_shards(csv_path, shard_count):
+    """Делит CSV на диапазоны по границам строк; None, если записи могут занимать несколько строк"""
+    with open(csv_path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data.find(b'"') != -1:
+                return None, None  # в кавычках может быть перевод строки - делим только простые файлы
+            header_end = data.find(b'\n') + 1
+            header = next(csv.reader([data[:header_end].decode('utf-8-sig')]))
+            size = len(data)
+            bounds = [header_end]
+            for i in range(1, shard_count):
+                cut = data.find(b'\n', max(header_end + (size - header_end) * i // shard_count, bounds[-1])) + 1
+                if cut <= 0:
+                    break
+                bounds.append(cut)
+            bounds.append(size)
+        finally:
+            data.close()
+    columns = (header.index('path'), header.index('type'), header.index('content') if 'content' in header else None)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a], columns
+
+def iter_mapped_text(store, offset, length, chunk_size=READ_CHUNK_SIZE):
+    """Декодирует UTF-8 текст из хранилища порциями, не собирая его целиком"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    end = offset + length
+    while offset < end:
+        size = min(chunk_size, end - offset)
+        text = decoder.decode(store.read_bytes(offset, size))
+        offset += size
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+class BackingStore:
+    """Файл с содержимым больших файлов VFS, читаемый через mmap"""
+    def __init__(self, path=None):
+        self.file = open(path, 'w+b') if path else tempfile.TemporaryFile()
+        self.size = 0
+        self.data = None
+    
+    def append(self, data):
+        """Дописывает данные в конец хранилища и возвращает их смещение"""
+        offset = self.size
+        self.file.seek(offset)
+        self.file.write(data)
+        self.size += len(data)
+        return offset
+    
+    def allocate(self, size):
+        """Резервирует в конце хранилища size байт (без записи) и возвращает их смещение"""
+        offset = self.size
+        self.size += size
+        self.file.truncate(self.size)
+        return offset
+    
+    def write(self, offset, data):
+        """Записывает данные в ранее зарезервированный участок"""
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.flush()  # участок может быть уже отображен - данные должны дойти до mmap
+    
+    def read_bytes(self, offset, length):
+        if self.data is None or len(self.data) < offset + length:
+            # Файл вырос после последнего отображения - отображаем заново
+            self.file.flush()
+            if self.data is not None:
+                self.data.close()
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.data[offset:offset + length]
+    
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+def reverse_lines(chunks, batch_size=READ_CHUNK_SIZE, empty_tail=True):
+    """Переворачивает каждую строку потока текста, выдавая результат порциями.
+    
+    Как и split('\\n'), последний (возможно пустой) фрагмент тоже считается строкой;
+    с empty_tail=False пустой фрагмент после завершающего перевода строки пропускается
+    """
+    tail = []  # куски незаконченной строки: склеиваются один раз, когда придет '\n'
+    batch = []
+    batch_len = 0
+    for chunk in chunks:
+        lines = chunk.split('\n')
+        tail.append(lines[0])
+        if len(lines) == 1:
+            continue
+        lines[0] = ''.join(tail)
+        tail = [lines.pop()]
+        for line in lines:
+            batch.append(line[::-1])
+            batch.append('\n')
+            batch_len += len(line) + 1
+        if batch_len >= batch_size:
+            yield ''.join(batch)
+            batch.clear()
+            batch_len = 0
+    tail = ''.join(tail)
+    if tail or empty_tail:
+        batch.append(tail[::-1])
+        batch.append('\n')
+    if batch:
+        yield ''.join(batch)
+
+def iter_stream_chunks(stream, chunk_size=READ_CHUNK_SIZE):
+    """Читает текстовый поток порциями"""
+    return iter(lambda: stream.read(chunk_size), '')
+
+class Journal:
+    """Журнал изменений VFS: записи только дописываются в конец и сбрасываются на диск группами"""
+    def __init__(self, path):
+        self.path = path
+        self.records = sum(1 for _ in self.read(path))
+        self.compact_at = JOURNAL_COMPACT_RECORDS  # сколько записей должно набраться до следующего сжатия
+        self.file = open(path, 'a', encoding='utf-8')
+        self.pending = []
+        self.pending_since = None
+    
+    @staticmethod
+    def read(path):
+        """Итерирует записи журнала; оборванная последняя строка пропускается"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break  # запись не успела дописаться до конца
+                yield json.loads(line)
+    
+    def append(self, record):
+        self.pending.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        self.records += 1
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        if (len(self.pending) >= JOURNAL_GROUP_RECORDS
+                or (time.monotonic() - self.pending_since) * 1000 >= JOURNAL_GROUP_MS):
+            self.flush()
+    
+    def flush(self):
+        """Записывает накопленную группу одним вызовом write и fsync"""
+        if not self.pending:
+            return
+        self.file.write('\n'.join(self.pending) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending.clear()
+        self.pending_since = None
+    
+    def rewrite(self, records):
+        """Атомарно заменяет журнал новым набором записей"""
+        self.pending.clear()
+        self.pending_since = None
+        self.file.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.records = len(records)
+        # Сжатый журнал бывает и больше порога: иначе он переписывался бы при каждом изменении
+        self.compact_at = max(JOURNAL_COMPACT_RECORDS, 2 * self.records)
+        self.file = open(self.path, 'a', encoding='utf-8')
+    
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def is_image_file(path):
+    """Проверяет, является ли файл бинарным образом VFS"""
+    with open(path, 'rb') as f:
+        return f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+
+class VFSImage:
+    """Бинарный образ VFS, отображенный в память через mmap"""
+    def __init__(self, image_path):
+        self.file = open(image_path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.node_count, self.strings_offset, _, self.contents_offset, _ = IMAGE_HEADER.unpack_from(self.data, 0)
+        if magic != IMAGE_MAGIC:
+            raise ValueError(f"{image_path} не является образом VFS")
+        self.nodes_offset = IMAGE_HEADER.size
+    
+    def record(self, index):
+        return IMAGE_NODE.unpack_from(self.data, self.nodes_offset + index * IMAGE_NODE.size)
+    
+    def load_children(self, node):
+        """Строит узлы детей директории из таблицы узлов"""
+        _, _, _, first_child, child_count, _, _ = self.record(node.source)
+        children = {}
+        for index in range(first_child, first_child + child_count):
+            name_offset, name_length, flags, _, _, _, _ = self.record(index)
+            start = self.strings_offset + name_offset
+            name = self.data[start:start + name_length].decode('utf-8')
+            child = VFSNode(name, is_directory=bool(flags & IMAGE_FLAG_DIRECTORY))
+            if child.is_directory:
+                child.children = None  # достраиваются при первом обращении
+            else:
+                _, _, _, _, _, content_offset, content_length = self.record(index)
+                child.extent = (self, self.contents_offset + content_offset, content_length)
+            child.source = index
+            child.parent = node
+            children[name] = child
+        node.children = children if children else EMPTY_CHILDREN
+    
+    def read_bytes(self, offset, length):
+        return self.data[offset:offset + length]
+    
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+class CSVIndex:
+    """Индекс-спутник <csv>.idx (SQLite): для каждой директории - ее дети и смещения их строк в CSV.
+    
+    Строится один раз и перестраивается, если CSV изменился
+    """
+    def __init__(self, vfs, csv_path):
+        self.vfs = vfs
+        self.csv_path = csv_path
+        self.db = sqlite3.connect(csv_path + '.idx')
+        signature = repr(VFS.file_signature(csv_path))
+        if self.stored_signature() != signature:
+            self.build(signature)
+        self.columns = json.loads(self.db.execute("SELECT value FROM meta WHERE key = 'columns'").fetchone()[0])
+        self.file = open(csv_path, 'rb')
+    
+    def stored_signature(self):
+        try:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        return row[0] if row else None
+    
+    @staticmethod
+    def iter_records(f):
+        """Итерирует (смещение, байты записи); запись в кавычках может занимать несколько строк"""
+        offset = f.tell()
+        while True:
+            record = f.readline()
+            if not record:
+                return
+            while record.count(b'"') % 2:
+                more = f.readline()
+                if not more:
+                    break
+                record += more
+            yield offset, record
+            offset += len(record)
+    
+    @staticmethod
+    def parse_record(record):
+        return next(csv.reader([record.decode('utf-8')]), None)
+    
+    def build(self, signature):
+        """Один проход по CSV: имена детей каждой директории в порядке появления и смещения строк файлов"""
+        csv.field_size_limit(2 ** 31 - 1)
+        entries = {}  # (директория, имя) -> [порядок, смещение строки файла или -1, директория ли]
+        with open(self.csv_path, 'rb') as f:
+            records = self.iter_records(f)
+            _, header_record = next(records, (0, b''))
+            header = self.parse_record(header_record) or []
+            header = [name.lstrip('\ufeff') for name in header]
+            columns = [header.index('path'), header.index('type'), header.index('content') if 'content' in header else None]
+            path_index, type_index, _ = columns
+            for offset, record in records:
+                row = self.parse_record(record)
+                if not row:
+                    continue
+                row_type = row[type_index] if type_index < len(row) else None
+                is_dir = row_type == 'directory' or row_type == 'folder'
+                parts = [p for p in row[path_index].split('/') if p]
+                directory = '/'
+                for i, part in enumerate(parts):
+                    entry = entries.get((directory, part))
+                    if entry is None:
+                        entry = entries[(directory, part)] = [len(entries), -1, True]
+                    if i == len(parts) - 1 and not is_dir:
+                        entry[1] = offset  # как create_file: последняя строка файла заменяет узел
+                        entry[2] = False
+                    directory = directory.rstrip('/') + '/' + part
+        
+        self.db.executescript("""
+            DROP TABLE IF EXISTS meta;
+            DROP TABLE IF EXISTS entries;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE entries (dir TEXT, name TEXT, seq INTEGER, offset INTEGER, is_dir INTEGER);
+        """)
+        self.db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+                            ((d, name, seq, offset, is_dir) for (d, name), (seq, offset, is_dir) in entries.items()))
+        self.db.execute("CREATE INDEX entries_dir ON entries (dir, seq)")
+        self.db.executemany("INSERT INTO meta VALUES (?, ?)", [('signature', signature), ('columns', json.dumps(columns))])
+        self.db.commit()
+    
+    def load_children(self, node):
+        """Строит детей директории по строкам CSV из индекса"""
+        _, _, content_index = self.columns
+        children = {}
+        rows = self.db.execute("SELECT name, offset, is_dir FROM entries WHERE dir = ? ORDER BY seq",
+                               (self.vfs.path_of(node),))
+        for name, offset, is_dir in rows:
+            child = VFSNode(name, is_directory=bool(is_dir))
+            if is_dir:
+                child.children = None  # достраиваются при первом обращении
+            else:
+                self.file.seek(offset)
+                _, record = next(self.iter_records(self.file))
+                row = self.parse_record(record)
+                content = row[content_index] if content_index is not None and content_index < len(row) else ''
+                encoded = content.encode('utf-8') if content else None
+                if encoded and len(encoded) >= self.vfs.store_min_bytes:
+                    child.extent = self.vfs.store_content(decode_content(encoded).encode('utf-8'))
+                elif encoded:
+                    child.encoded = encoded
+                else:
+                    child.content = ''
+            child.parent = node
+            children[name] = child
+        node.children = children if children else EMPTY_CHILDREN
+    
+    def close(self):
+        self.file.close()
+        self.db.close()
+
+def compile_image(csv_path, image_path, load_workers=None):
+    """Преобразует CSV-описание VFS в бинарный образ"""
+    vfs = VFS(csv_path, load_workers=load_workers)
+    
+    # Обход в ширину: дети каждой директории получают соседние индексы
+    order = [vfs.root]
+    first_child = {}
+    queue = deque([vfs.root])
+    while queue:
+        node = queue.popleft()
+        if node.is_directory:
+            first_child[id(node)] = len(order)
+            for child in node.children.values():
+                order.append(child)
+                queue.append(child)
+    
+    strings = bytearray()
+    name_refs = []
+    for node in order:
+        name = node.name.encode('utf-8')
+        name_refs.append((len(strings), len(name)))
+        strings += name
+    
+    strings_offset = IMAGE_HEADER.size + len(order) * IMAGE_NODE.size
+    contents_offset = strings_offset + len(strings)
+    with open(image_path, 'wb') as f:
+        # Содержимое пишется потоком, таблица узлов дописывается в конце
+        f.seek(contents_offset)
+        records = []
+        contents_size = 0
+        for node, (name_offset, name_length) in zip(order, name_refs):
+            if node.is_directory:
+                records.append(IMAGE_NODE.pack(name_offset, name_length, IMAGE_FLAG_DIRECTORY,
+                                               first_child[id(node)], len(node.children), 0, 0))
+            else:
+                data = vfs.read_file_uncached(node).encode('utf-8')
+                f.write(data)
+                records.append(IMAGE_NODE.pack(name_offset, name_length, 0, 0, 0, contents_size, len(data)))
+                contents_size += len(data)
+        f.seek(0)
+        f.write(IMAGE_HEADER.pack(IMAGE_MAGIC, len(order), strings_offset, len(strings), contents_offset, contents_size))
+        f.write(b''.join(records))
+        f.write(strings)
+    vfs.close()
+    return len(order)
+
+class PathCache:
+    """LRU-кэш соответствия нормализованный путь -> узел со счетчиками попаданий"""
+    def __init__(self, max_entries=DEFAULT_PATH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, path):
+        node = self.entries.get(path)
+        if node is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(path)
+        return node
+    
+    def put(self, path, node):
+        self.entries[path] = node
+        self.entries.move_to_end(path)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def clear(self):
+        self.entries.clear()
+    
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+class Profiler:
+    """Накапливает время операций: число вызовов, суммарное реальное и процессорное время, гистограмму задержек"""
+    def __init__(self):
+        self.stats = {}  # имя -> [число, реальное, процессорное, максимум, {корзина: число}]
+    
+    def record(self, name, wall, cpu):
+        entry = self.stats.get(name)
+        if entry is None:
+            entry = self.stats[name] = [0, 0.0, 0.0, 0.0, {}]
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] += cpu
+        if wall > entry[3]:
+            entry[3] = wall
+        # Корзины по степеням двойки микросекунд: 0 - до 1 мкс, k - до 2**k мкс
+        bucket = max(int(wall * 1e6), 1).bit_length()
+        histogram = entry[4]
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+    
+    def total(self, name):
+        """Суммарное реальное время операции name в секундах"""
+        entry = self.stats.get(name)
+        return entry[1] if entry else 0.0
+    
+    def report(self):
+        """Текстовый отчет, операции упорядочены по суммарному времени"""
+        lines = []
+        for name, (count, wall, cpu, peak, histogram) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name}: вызовов {count}, всего {wall * 1000:.3f} мс, процессор {cpu * 1000:.3f} мс, "
+                         f"среднее {wall / count * 1e6:.1f} мкс, максимум {peak * 1e6:.1f} мкс")
+            largest = max(histogram.values())
+            for bucket in sorted(histogram):
+                hits = histogram[bucket]
+                bar = '#' * max(1, hits * 40 // largest)
+                lines.append(f"  < {2 ** bucket:>11} мкс {hits:>8} {bar}")
+        return '\n'.join(lines) + '\n' if lines else ''
+
+def normalize_path(path):
+    """Приводит путь к виду /a/b без повторных и завершающих слешей"""
+    if path.startswith('/') and '//' not in path and (path == '/' or not path.endswith('/')):
+        return path  # уже нормализован, обходимся без split
+    return '/' + '/'.join(p for p in path.split('/') if p)
 
 class VFS:
-    def __init__(self, csv_path=None):
+    def __init__(self, vfs_path=None, cache_bytes=DEFAULT_CONTENT_CACHE_BYTES, path_cache_size=DEFAULT_PATH_CACHE_SIZE,
+                 load_workers=None, store_path=None, store_min_bytes=DEFAULT_STORE_MIN_BYTES, journal=False,
+                 watch=False, lazy=False):
         self.root = VFSNode('/', is_directory=True)
-        if csv_path:
-            print(f"DEBUG: Загрузка VFS из {csv_path}")  # Отладочный вывод
-            self.load_from_csv(csv_path)
-            print(f"DEBUG: VFS успешно загружена")  # Отладочный вывод
+        self.content_cache = ContentCache(cache_bytes)
+        # Хранилище больших файлов создается при первой необходимости
+        self.store = None
+        self.store_path = store_path
+        self.store_min_bytes = store_min_bytes
+        # Дописываемые файлы получают участок хранилища с запасом: смещение -> зарезервированный размер
+        self.reserved = {}
+        self.path_cache = PathCache(path_cache_size)
+        self.users = IdTable()
+        self.groups = IdTable()
+        # Снимки: узлы разделяются между снимком и текущим деревом, а перед первым
+        # изменением поля узла после снимка его прежнее значение пишется в журнал отката
+        self.checkpoints = []  # [(длина undo_log на момент снимка, уже сохраненные (узел, поле))]
+        self.undo_log = []  # [(узел, поле, прежнее значение)]
+        # Глобальный индекс имя -> множество узлов, поддерживается attach/detach
+        self.name_index = {}
+        # Отсортированные имена детей директории (для дополнения по Tab): строятся при первом
+        # обращении к директории и дальше поддерживаются attach/detach
+        self.sorted_names = {}
+        # Источник ленивых директорий (VFSImage или CSVIndex): children=None, пока их не открыли
+        self.loader = None
+        self.loader_indexed = False
+        # Журнал изменений рядом с образом; узлы, отличающиеся от образа, нужны для сжатия журнала
+        self.journal = None
+        self.changed_content = None  # созданные директории и файлы
+        self.changed_owner = None  # узлы со сменой владельца
+        # Отслеживание изменений CSV: строки последней загруженной версии
+        self.watch_path = None
+        self.watch_signature = None
+        self.watch_rows = None
+        self.watch_columns = None
+        self.watch_paths = None
+        # Проверка прерывания, которую поток команды ставит на время ее выполнения
+        self.interrupt = threading.local()
+        if vfs_path:
+            print(f"DEBUG: Загрузка VFS из {vfs_path}", file=sys.stderr)  # Отладочный вывод
+            if is_image_file(vfs_path):
+                self.load_from_image(vfs_path)
+            elif lazy and not watch:
+                # Со --watch дерево строится целиком: индекс устареет при первой же правке CSV
+                self.load_from_csv_index(vfs_path)
+            else:
+                self.load_from_csv(vfs_path, load_workers)
+            if watch and self.loader is None:
+                self.watch(vfs_path)
+            if journal:
+                self.open_journal(vfs_path + '.journal')
+            print(f"DEBUG: VFS успешно загружена", file=sys.stderr)  # Отладочный вывод
+    
+    def watch(self, csv_path):
+        """Запоминает дайджесты строк CSV, чтобы при его изменении применять только разницу"""
+        self.watch_path = csv_path
+        self.watch_signature = self.file_signature(csv_path)
+        self.watch_rows = {}
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            reader = self.csv_reader(f)
+            header = next(reader, None)
+            self.watch_columns = self.csv_columns(header) if header else None
+            for row in reader:
+                if row:
+                    path, is_dir, _ = self.parse_entry(row, self.watch_columns)
+                    self.watch_rows[self.row_digest(row)] = (path, is_dir)
+        self.watch_paths = Counter(path for path, _ in self.watch_rows.values())
+    
+    @staticmethod
+    def file_signature(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    
+    @staticmethod
+    def csv_reader(f):
+        csv.field_size_limit(2 ** 31 - 1)
+        return csv.reader(f)
+    
+    @staticmethod
+    def row_digest(row):
+        """Дайджест строки CSV: по нему видно, изменилась ли строка, а содержимое в памяти не хранится.
+        Встроенный 64-битный hash (SipHash) живет только в пределах процесса, как и сами дайджесты"""
+        return hash(tuple(row))
+    
+    @staticmethod
+    def csv_columns(header):
+        header = list(header)
+        header[0] = header[0].lstrip('\ufeff')
+        return header.index('path'), header.index('type'), header.index('content') if 'content' in header else None
+    
+    @staticmethod
+    def parse_entry(row, columns):
+        """Разбирает строку CSV в (нормализованный путь, директория ли, содержимое)"""
+        path_index, type_index, content_index = columns
+        row_type = row[type_index] if type_index < len(row) else None
+        content = row[content_index] if content_index is not None and content_index < len(row) else ''
+        return normalize_path(row[path_index]), row_type == 'directory' or row_type == 'folder', content
+    
+    def reload_if_changed(self):
+        """Применяет изменения CSV, если файл изменился; возвращает (добавлено, удалено) или None.
+        Файл читается потоком, а разбираются и держатся в памяти только изменившиеся строки"""
+        if self.watch_path is None:
+            return None
+        try:
+            signature = self.file_signature(self.watch_path)
+        except OSError:
+            return None  # файл сейчас перезаписывается
+        if signature == self.watch_signature:
+            return None
+        rows = {}
+        added_entries = []
+        with open(self.watch_path, 'r', encoding='utf-8', newline='') as f:
+            reader = self.csv_reader(f)
+            header = next(reader, None)
+            if header is None:
+                return None
+            columns = self.csv_columns(header)
+            # При другом порядке колонок прежние строки не сопоставить - дерево строится заново
+            old_rows = self.watch_rows if columns == self.watch_columns else {}
+            for row in reader:
+                if not row:
+                    continue
+                digest = self.row_digest(row)
+                if digest in rows:
+                    continue  # повтор строки ничего не меняет
+                entry = old_rows.get(digest)
+                if entry is None:
+                    path, is_dir, content = self.parse_entry(row, columns)
+                    entry = (path, is_dir)
+                    added_entries.append((path, is_dir, content))
+                rows[digest] = entry
+        if old_rows:
+            removed_entries = [entry for digest, entry in old_rows.items() if digest not in rows]
+        else:
+            removed_entries = list(self.watch_rows.values())
+        if not added_entries and not removed_entries:
+            self.watch_signature = signature
+            return 0, 0
+        
+        # Сколько строк CSV задают каждый путь: узел удаляется, только когда их не осталось
+        paths = Counter(self.watch_paths)
+        paths.subtract(path for path, _ in removed_entries)
+        paths.update(path for path, _, _ in added_entries)
+        
+        # Изменения образа - не изменения сеанса: не журналируем их, а снимки сбрасываем
+        journal, self.journal = self.journal, None
+        changed_content, self.changed_content = self.changed_content, None
+        self.checkpoints.clear()
+        self.undo_log.clear()
+        try:
+            candidates = set()
+            for path, is_dir in removed_entries:
+                if path == '/' or paths[path] > 0:
+                    continue  # путь остался в других строках, узел будет заменен
+                if is_dir:
+                    candidates.add(path)
+                else:
+                    self.remove_node(path)
+                # Неявно созданные родители могли опустеть
+                parent = path.rsplit('/', 1)[0]
+                while parent and parent not in candidates:
+                    candidates.add(parent)
+                    parent = parent.rsplit('/', 1)[0]
+            # Директорию удаляем, только если ее не задает ни одна строка и под ней пусто
+            for path in sorted(candidates, key=lambda p: p.count('/'), reverse=True):
+                node = self.get_node(path)
+                if paths[path] <= 0 and node and node.is_directory and not self.children_of(node):
+                    self.remove_node(path)
+            # Узел, сменивший тип, заменяется целиком: до добавлений, ведь строки идут в любом порядке
+            for path, is_dir, _ in added_entries:
+                node = self.get_node(path)
+                if node is not None and node.is_directory != is_dir:
+                    self.remove_node(path)
+            for path, is_dir, content in added_entries:
+                self.add_entry(path, is_dir, content.encode('utf-8') if content else None)
+        finally:
+            self.journal = journal
+            self.changed_content = changed_content
+        # Новую версию запоминаем только после успешного применения: иначе разница повторится
+        self.watch_signature = signature
+        self.watch_columns = columns
+        self.watch_rows = rows
+        self.watch_paths = +paths
+        return len(added_entries), len(removed_entries)
+    
+    def remove_node(self, path):
+        """Удаляет узел по пути"""
+        node = self.get_node(path)
+        if node is None or node is self.root:
+            return None
+        return self.detach(node.parent, node.name)
+    
+    def open_journal(self, journal_path):
+        """Применяет к загруженному образу записанные изменения и начинает журналировать новые"""
+        self.changed_content = set()
+        self.changed_owner = set()
+        for record in Journal.read(journal_path):
+            self.apply_record(record)
+        # Снимки живут только в пределах сеанса
+        self.checkpoints.clear()
+        self.undo_log.clear()
+        self.journal = Journal(journal_path)
+        if self.journal.records >= self.journal.compact_at:
+            self.compact_journal()  # снимков после загрузки нет - сжатие ничего не теряет
+        else:
+            self.log_change('begin')
+    
+    def apply_record(self, record):
+        op = record[0]
+        if op == 'begin':
+            self.checkpoints.clear()
+            self.undo_log.clear()
+        elif op == 'chown':
+            self.change_owner(*record[1:])
+        elif op == 'mkdir':
+            self.create_directory(record[1])
+        elif op == 'write':
+            node = self.get_node(record[1])
+            if node is not None and not node.is_directory:
+                self.replace_content(node, record[2])
+            else:
+                self.create_file(record[1], record[2])
+        elif op == 'append':
+            node = self.get_node(record[1])
+            if node is None:
+                # Файла нет в образе (например, CSV изменили) - дописываем в новый пустой
+                self.create_file(record[1], '')
+                node = self.get_node(record[1])
+            if not node.is_directory:
+                self.append_content(node, record[2])
+        elif op == 'snapshot':
+            self.snapshot()
+        elif op == 'rollback':
+            self.rollback(record[1])
+    
+    def log_change(self, *record):
+        """Добавляет запись в журнал изменений, если он ведется"""
+        if self.journal is None:
+            return
+        self.journal.append(record)
+        # Сжатый журнал не хранит снимков, и откат к ним не повторился бы при загрузке:
+        # пока снимки есть, журнал сожмется при следующем запуске (open_journal)
+        if self.journal.records >= self.journal.compact_at and not self.checkpoints:
+            self.compact_journal()
+    
+    def compact_journal(self):
+        """Переписывает журнал минимальным набором записей, дающим текущее состояние"""
+        records = [('begin',)]
+        content_nodes = sorted((self.path_of(node), node) for node in self.changed_content if self.is_attached(node))
+        for path, node in content_nodes:
+            if node.is_directory:
+                records.append(('mkdir', path))
+            else:
+                records.append(('write', path, self.read_file_uncached(node)))
+        owner_nodes = sorted((self.path_of(node), node) for node in self.changed_owner if self.is_attached(node))
+        for path, node in owner_nodes:
+            records.append(('chown', path) + self.owner_of(node))
+        self.changed_content = {node for _, node in content_nodes}
+        self.changed_owner = {node for _, node in owner_nodes}
+        self.journal.rewrite(records)
+    
+    def is_attached(self, node):
+        """Проверяет, что узел достижим от корня"""
+        while node.parent is not None:
+            if node.parent.children is None or node.parent.children.get(node.name) is not node:
+                return False
+            node = node.parent
+        return node is self.root
+    
+    def close(self):
+        """Закрывает журнал, хранилище больших файлов и образ или индекс; после этого VFS не используется"""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        if self.loader is not None:
+            self.loader.close()
+            self.loader = None
+        self.watch_path = None  # закрытую VFS больше не обновляем
+    
+    def load_from_image(self, image_path):
+        """Подключает бинарный образ VFS, узлы строятся по мере обращения"""
+        self.loader = VFSImage(image_path)
+        self.root.children = None
+        self.root.source = 0
+    
+    def load_from_csv_index(self, csv_path):
+        """Подключает CSV через индекс-спутник, директории строятся по мере обращения"""
+        self.loader = CSVIndex(self, csv_path)
+        self.root.children = None
+    
+    def check_interrupt(self):
+        """Точка прерывания долгих операций: вызывает проверку, установленную потоком команды"""
+        check = getattr(self.interrupt, 'check', None)
+        if check is not None:
+            check()
+    
+    def children_of(self, node):
+        """Возвращает детей директории, при необходимости достраивая их из образа или индекса"""
+        if node.children is None:
+            self.check_interrupt()
+            self.loader.load_children(node)
+            for child in node.children.values():
+                self.index_node(child)
+        return node.children
+    
+    def index_node(self, node):
+        nodes = self.name_index.get(node.name)
+        if nodes is None:
+            nodes = self.name_index[node.name] = set()
+        nodes.add(node)
+    
+    def unindex_subtree(self, node):
+        """Убирает из индекса имен узел и всех его уже построенных потомков"""
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            nodes = self.name_index.get(current.name)
+            if nodes is not None:
+                nodes.discard(current)
+                if not nodes:
+                    del self.name_index[current.name]
+            self.sorted_names.pop(current, None)
+            if current.is_directory and current.children is not None:
+                stack.extend(current.children.values())
+    
+    def index_subtree(self, node):
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            self.index_node(current)
+            if current.is_directory and current.children is not None:
+                stack.extend(current.children.values())
+    
+    def remember(self, node, field):
+        """Сохраняет значение поля узла перед его первым изменением после последнего снимка"""
+        if not self.checkpoints:
+            return
+        saved = self.checkpoints[-1][1]
+        key = (node, field)
+        if key in saved:
+            return
+        saved.add(key)
+        self.undo_log.append((node, field, getattr(node, field)))
+    
+    def remember_child(self, parent, name, removing=False):
+        """Сохраняет прежнего ребенка parent с именем name (None - его не было) перед первым изменением
+        после снимка: запись занимает O(1), сколько бы детей ни было у директории"""
+        if not self.checkpoints:
+            return
+        saved = self.checkpoints[-1][1]
+        if removing and (parent, 'order') not in saved:
+            # Удаленное имя при откате вернется в конец словаря: запоминаем порядок один раз,
+            # до первого удаления (вставки и замены порядок прежних имен не меняют)
+            saved.add((parent, 'order'))
+            self.undo_log.append((parent, 'order', list(parent.children)))
+        key = (parent, 'child', name)
+        if key in saved:
+            return
+        saved.add(key)
+        self.undo_log.append((parent, 'child', (name, parent.children.get(name))))
+    
+    def snapshot(self):
+        """Создает снимок за O(1) и возвращает его номер"""
+        self.checkpoints.append((len(self.undo_log), set()))
+        self.log_change('snapshot')
+        return len(self.checkpoints)
+    
+    def rollback(self, number=None):
+        """Возвращает дерево к снимку (по умолчанию последнему); более поздние снимки удаляются"""
+        if number is None:
+            number = len(self.checkpoints)
+        if not 1 <= number <= len(self.checkpoints):
+            return False
+        self.check_interrupt()  # дальше откат идет до конца: наполовину восстановленное дерево хуже
+        log_start = self.checkpoints[number - 1][0]
+        orders = {}
+        while len(self.undo_log) > log_start:
+            node, field, value = self.undo_log.pop()
+            if field == 'child':
+                self.restore_child(node, *value)
+            elif field == 'order':
+                orders[node] = value  # нужен самый ранний порядок - он запомнен последним из снятых
+            else:
+                setattr(node, field, value)
+                self.content_cache.discard(node)
+                if self.changed_owner is not None and field in ('uid', 'gid'):
+                    self.changed_owner.add(node)
+        for node, order in orders.items():
+            children = node.children
+            node.children = {name: children[name] for name in order if name in children}
+            node.children.update(children)
+        del self.checkpoints[number:]
+        self.checkpoints[-1] = (log_start, set())  # снимок остается для следующих откатов
+        self.path_cache.clear()
+        self.log_change('rollback', number)
+        return True
+    
+    def restore_child(self, parent, name, child):
+        """Возвращает parent ребенка child под именем name (None - убирает имя)"""
+        children = parent.children
+        current = children.get(name)
+        if current is child:
+            return
+        names = self.sorted_names.get(parent)
+        if current is not None:
+            self.unindex_subtree(current)
+            self.content_cache.discard(current)
+            if child is None:
+                del children[name]
+                if names is not None:
+                    del names[bisect.bisect_left(names, name)]
+                return
+        elif names is not None:
+            bisect.insort(names, name)
+        if children is EMPTY_CHILDREN:
+            children = parent.children = {}
+        child.parent = parent
+        children[name] = child
+        self.index_subtree(child)
+    
+    def attach(self, parent, node):
+        """Добавляет узел в директорию"""
+        children = self.children_of(parent)
+        self.remember_child(parent, node.name)
+        if children is EMPTY_CHILDREN:
+            children = parent.children = {}
+        old = children.get(node.name)
+        if old is not None:
+            # Узел заменяется - закэшированные пути могут указывать на старое поддерево
+            self.path_cache.clear()
+            self.unindex_subtree(old)
+            self.content_cache.discard(old)
+        else:
+            names = self.sorted_names.get(parent)
+            if names is not None:
+                bisect.insort(names, node.name)
+        node.parent = parent
+        children[node.name] = node
+        self.index_node(node)
+        if self.changed_content is not None:
+            self.changed_content.add(node)
+        return node
+    
+    def detach(self, parent, name):
+        """Удаляет узел из директории"""
+        self.children_of(parent)
+        if name in parent.children:
+            self.remember_child(parent, name, removing=True)
+        node = parent.children.pop(name, None)
+        if node is not None:
+            names = self.sorted_names.get(parent)
+            if names is not None:
+                del names[bisect.bisect_left(names, name)]
+            self.path_cache.clear()
+            self.unindex_subtree(node)
+            self.content_cache.discard(node)
+            node.parent = None
+        return node
     
-    def load_from_csv(self, csv_path):
+    def load_from_csv(self, csv_path, workers=None):
         """Загружает VFS из CSV файла"""
+        if workers and workers > 1 and os.path.getsize(csv_path) >= PARALLEL_LOAD_MIN_BYTES:
+            if self.load_from_csv_parallel(csv_path, workers):
+                return
+        # Стандартный лимит поля csv (128 КБ) меньше содержимого больших файлов
+        csv.field_size_limit(2 ** 31 - 1)
         with open(csv_path, 'r', encoding='utf-8') as f:
             reader = csv.DictReader(f)
             for row in reader:
                 path = row['path']
                 is_dir = row['type'] == 'directory' or row['type'] == 'folder'
                 content = row.get('content', '')
-                
-                if is_dir:
-                    self.create_directory(path)
-                else:
-                    if content:
-                        try:
-                            decoded_content = base64.b64decode(content).decode('utf-8')
-                        except:
-                            decoded_content = content  
-                    else:
-                        decoded_content = ''
-                    self.create_file(path, decoded_content)
+                # Декодирование откладывается до первого read_file
+                self.add_entry(path, is_dir, content.encode('utf-8') if content else None)
+    
+    def load_from_csv_parallel(self, csv_path, workers):
+        """Разбирает CSV по частям в пуле процессов и собирает дерево в исходном порядке строк"""
+        shards, columns = split_csv_shards(csv_path, workers)
+        if shards is None:
+            return False
+        with open(csv_path, 'rb') as f, ProcessPoolExecutor(max_workers=workers) as pool:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            futures = [pool.submit(parse_csv_shard, csv_path, start, end, columns) for start, end in shards]
+            for future in futures:
+                for path, is_dir, offset, length in future.result():
+                    self.add_entry(path, is_dir, data[offset:offset + length] if length else None)
+            data.close()
+        return True
+    
+    def add_entry(self, path, is_dir, encoded):
+        """Добавляет запись CSV в дерево"""
+        if is_dir:
+            self.create_directory(path)
+        elif encoded and len(encoded) >= self.store_min_bytes:
+            self.create_file(path, extent=self.store_content(decode_content(encoded).encode('utf-8')))
+        elif encoded:
+            self.create_file(path, encoded=encoded)
+        else:
+            self.create_file(path, '')
+    
+    def store_content(self, data):
+        """Переносит содержимое в хранилище и возвращает его extent"""
+        if self.store is None:
+            self.store = BackingStore(self.store_path)
+        return (self.store, self.store.append(data), len(data))
     
     def create_directory(self, path):
         """Создает директорию по пути"""
@@ -53,148 +1141,495 @@ class VFS:
         current = self.root
         
         for part in path_parts:
-            if part not in current.children:
-                new_dir = VFSNode(part, is_directory=True)
-                new_dir.parent = current
-                current.children[part] = new_dir
-            current = current.children[part]
+            child = self.children_of(current).get(part)
+            if child is None:
+                child = self.attach(current, VFSNode(part, is_directory=True))
+            current = child
+        self.log_change('mkdir', normalize_path(path))
     
-    def create_file(self, path, content):
+    def create_file(self, path, content=None, encoded=None, extent=None):
         path_parts = [p for p in path.split('/') if p]
         filename = path_parts[-1]
         dir_path = path_parts[:-1]
         
         current = self.root
         for part in dir_path:
-            if part not in current.children:
-                new_dir = VFSNode(part, is_directory=True)
-                new_dir.parent = current
-                current.children[part] = new_dir
-            current = current.children[part]
+            child = self.children_of(current).get(part)
+            if child is None:
+                child = self.attach(current, VFSNode(part, is_directory=True))
+            current = child
         
         file_node = VFSNode(filename, is_directory=False, content=content)
-        file_node.parent = current
-        current.children[filename] = file_node
+        file_node.encoded = encoded
+        file_node.extent = extent
+        self.attach(current, file_node)
+        if content is not None:
+            self.log_change('write', normalize_path(path), content)
+    
+    def write_file_chunks(self, path, chunks, append=False):
+        """Записывает в файл (с append - дописывает) текст из итератора порций, накапливая
+        порции в буфер размером READ_CHUNK_SIZE; возвращает False, если path - директория"""
+        node = self.get_node(path)
+        if node is not None and node.is_directory:
+            return False
+        if node is None:
+            self.create_file(path, '')
+            node = self.get_node(path)
+        elif not append:
+            self.replace_content(node, '')  # узел остается прежним: владелец не сбрасывается
+        buffer = []
+        buffered = 0
+        for chunk in chunks:
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= READ_CHUNK_SIZE:
+                self.append_content(node, ''.join(buffer))
+                buffer.clear()
+                buffered = 0
+        if buffer:
+            self.append_content(node, ''.join(buffer))
+        return True
+    
+    def replace_content(self, node, content):
+        """Заменяет содержимое существующего файла, не трогая сам узел"""
+        for field in ('content', 'encoded', 'extent'):
+            self.remember(node, field)
+        self.content_cache.discard(node)
+        node.content = content
+        node.encoded = node.extent = None
+        if self.changed_content is not None:
+            self.changed_content.add(node)
+        self.log_change('write', self.path_of(node), content)
+    
+    def append_content(self, node, text):
+        """Дописывает текст в конец файла. Малые файлы остаются строкой, большие растут в хранилище
+        на месте, а при нехватке места переносятся в участок вдвое больше нужного, так что
+        прежнее содержимое копируется лишь O(log n) раз"""
+        if not text:
+            return
+        data = text.encode('utf-8')
+        for field in ('content', 'encoded', 'extent'):
+            self.remember(node, field)
+        self.content_cache.discard(node)
+        if node.extent is None:
+            old = self.read_file_uncached(node) or ''
+            if len(old) + len(text) < self.store_min_bytes:
+                node.content = old + text
+                node.encoded = None
+            else:
+                node.extent = self.reserve_extent(old.encode('utf-8') + data)
+                node.content = node.encoded = None
+        else:
+            store, offset, length = node.extent
+            if store is self.store and length + len(data) <= self.reserved.get(offset, 0):
+                store.write(offset + length, data)
+                node.extent = (store, offset, length + len(data))
+            else:
+                node.extent = self.reserve_extent(data, node.extent)
+        if self.changed_content is not None:
+            self.changed_content.add(node)
+        self.log_change('append', self.path_of(node), text)
+    
+    def reserve_extent(self, data, old_extent=None):
+        """Размещает в хранилище прежнее содержимое old_extent и data с запасом под дописывание"""
+        if self.store is None:
+            self.store = BackingStore(self.store_path)
+        old_length = old_extent[2] if old_extent else 0
+        length = old_length + len(data)
+        capacity = max(length * 2, READ_CHUNK_SIZE)
+        offset = self.store.allocate(capacity)
+        self.reserved[offset] = capacity
+        if old_extent:
+            store, old_offset, _ = old_extent
+            for start in range(0, old_length, READ_CHUNK_SIZE):
+                size = min(READ_CHUNK_SIZE, old_length - start)
+                self.store.write(offset + start, store.read_bytes(old_offset + start, size))
+        self.store.write(offset + old_length, data)
+        return (self.store, offset, length)
     
     def get_node(self, path):
         if path == '/' or path == '':
             return self.root
         
-        path_parts = [p for p in path.split('/') if p]
-        current = self.root
+        path = normalize_path(path)
+        current = self.path_cache.get(path)
+        if current is not None:
+            return current
         
-        for part in path_parts:
-            if current.is_directory and part in current.children:
+        current = self.root
+        for part in path.split('/')[1:]:
+            if current.is_directory and part in self.children_of(current):
                 current = current.children[part]
             else:
                 return None
+        self.path_cache.put(path, current)
         return current
     
+    def path_of(self, node):
+        """Восстанавливает абсолютный путь узла по ссылкам на родителей"""
+        parts = []
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return '/' + '/'.join(reversed(parts))
+    
+    def find(self, path='/', pattern=None, node_type=None):
+        """Ищет узлы под path по шаблону имени (glob) и типу ('f' или 'd'), возвращает пути"""
+        start = self.get_node(path)
+        if start is None:
+            return None
+        if self.loader is not None and not self.loader_indexed:
+            # Ленивые узлы попадают в индекс при построении - достраиваем все один раз
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                stack.extend(child for child in self.children_of(node).values() if child.is_directory)
+            self.loader_indexed = True
+        
+        if pattern is None:
+            # Без шаблона имени нужен обход поддерева
+            candidates = []
+            stack = [start]
+            while stack:
+                node = stack.pop()
+                candidates.append(node)
+                if node.is_directory:
+                    stack.extend(node.children.values())
+                if len(candidates) % INTERRUPT_CHECK_NODES == 0:
+                    self.check_interrupt()
+        elif any(c in pattern for c in '*?['):
+            candidates = [node for name in fnmatch.filter(self.name_index, pattern) for node in self.name_index[name]]
+        else:
+            candidates = self.name_index.get(pattern, ())
+        
+        prefix = self.path_of(start)
+        results = []
+        for count, node in enumerate(candidates, 1):
+            if count % INTERRUPT_CHECK_NODES == 0:
+                self.check_interrupt()
+            if node_type == 'f' and node.is_directory or node_type == 'd' and not node.is_directory:
+                continue
+            node_path = self.path_of(node)
+            if node is start or prefix == '/' or node_path.startswith(prefix + '/'):
+                results.append(node_path)
+        results.sort()
+        return results
+    
     def list_directory(self, path):
         node = self.get_node(path)
         if node and node.is_directory:
-            return list(node.children.keys())
+            return list(self.children_of(node).keys())
         return []
     
+    def complete_names(self, path, prefix='', limit=None):
+        """Дети директории path, имена которых начинаются с prefix, по алфавиту.
+        Возвращает ([(имя, директория ли)] не длиннее limit, общий префикс всех подходящих имен, их число);
+        поиск идет двоичным поиском по sorted_names и не зависит от размера директории"""
+        node = self.get_node(path)
+        if not node or not node.is_directory:
+            return [], prefix, 0
+        children = self.children_of(node)
+        names = self.sorted_names.get(node)
+        if names is None:
+            names = self.sorted_names[node] = sorted(children)
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + '\U0010ffff', start)
+        if start == end:
+            return [], prefix, 0
+        common = os.path.commonprefix([names[start], names[end - 1]])
+        stop = end if limit is None else min(end, start + limit)
+        return [(name, children[name].is_directory) for name in names[start:stop]], common, end - start
+    
     def read_file(self, path):
         node = self.get_node(path)
         if node and not node.is_directory:
-            return node.content
+            if node.encoded is None and node.extent is None:
+                return node.content
+            content = self.content_cache.get(node)
+            if content is None:
+                content = self.read_file_uncached(node)
+                self.content_cache.put(node, content, sys.getsizeof(content))  # память строки, а не число символов
+            return content
         return None
     
-    def change_owner(self, path, owner, group=None):
+    def read_file_uncached(self, node):
+        """Возвращает содержимое файла, минуя кэш"""
+        if node.encoded is not None:
+            return decode_content(node.encoded)
+        if node.extent is not None:
+            store, offset, length = node.extent
+            return store.read_bytes(offset, length).decode('utf-8')
+        return node.content
+    
+    def read_file_chunks(self, path, chunk_size=READ_CHUNK_SIZE):
+        """Возвращает итератор по порциям содержимого файла или None, если файла нет"""
+        node = self.get_node(path)
+        if not node or node.is_directory:
+            return None
+        if node.extent is not None and node.extent[2] > chunk_size:
+            store, offset, length = node.extent
+            return iter_mapped_text(store, offset, length, chunk_size)
+        content = self.read_file(path)
+        return iter([content] if content else [])
+    
+    def change_owner(self, path, owner, group=None, recursive=False):
         node = self.get_node(path)
         if node:
-            node.owner = owner
-            if group:
-                node.group = group
+            uid = self.users.id_of(owner)
+            gid = self.groups.id_of(group) if group else None
+            # Сначала собираем поддерево (здесь команду можно прервать), затем меняем все узлы сразу
+            nodes = [node]
+            if recursive:
+                stack = [node]
+                visited = 0
+                while stack:
+                    current = stack.pop()
+                    visited += 1
+                    if visited % INTERRUPT_CHECK_NODES == 0:
+                        self.check_interrupt()
+                    if current.is_directory:
+                        children = self.children_of(current).values()
+                        nodes.extend(children)
+                        stack.extend(children)
+            remember = self.remember if self.checkpoints else None
+            changed = self.changed_owner
+            for current in nodes:
+                if remember:
+                    remember(current, 'uid')
+                    remember(current, 'gid')
+                if changed is not None:
+                    changed.add(current)
+                current.uid = uid
+                if gid is not None:
+                    current.gid = gid
+            self.log_change('chown', normalize_path(path), owner, group, recursive)
             return True
         return False
+    
+    def owner_of(self, node):
+        """Возвращает (владелец, группа) узла"""
+        return self.users.name_of(node.uid), self.groups.name_of(node.gid)
+    
+    def list_directory_long(self, path):
+        """Как list_directory, но со сведениями об узлах: (имя, директория ли, владелец, группа)"""
+        node = self.get_node(path)
+        if node and node.is_directory:
+            return [(child.name, child.is_directory) + self.owner_of(child) for child in self.children_of(node).values()]
+        return []
 
-class TerminalEmulator:
-    def __init__(self, root, vfs_path=None, script_path=None):
-        self.root = root
+class Command:
+    """Описание команды терминала: обработчик и метаданные аргументов"""
+    def __init__(self, name, handler, min_args=0, max_args=None, usage=None, needs_vfs=False, writes=False,
+                 local=False, stdin=False):
+        self.name = name
+        self.handler = handler  # handler(shell, args)
+        self.min_args = min_args
+        self.max_args = max_args
+        self.usage = usage
+        self.needs_vfs = needs_vfs
+        self.writes = writes  # меняет VFS: на сервере выполняется под блокировкой записи
+        self.local = local  # выполняется клиентом, а не сервером VFS
+        self.stdin = stdin  # читает вход: handler(shell, args, input_chunks)
+
+class CommandCancelled(Exception):
+    """Команда прервана (Ctrl-C или истекло время выполнения)"""
+
+# Реестр команд: имя -> Command. Пополняется через register_command,
+# в том числе извне, без правки класса Shell. Обработчик-генератор выдает вывод
+# порциями, и его можно передать по конвейеру (|) следующей команде
+COMMANDS = {}
+
+def register_command(name, handler=None, min_args=0, max_args=None, usage=None, needs_vfs=False, writes=False,
+                     local=False, stdin=False):
+    """Регистрирует команду; без handler работает как декоратор"""
+    def decorator(func):
+        COMMANDS[name] = Command(name, func, min_args, max_args, usage, needs_vfs, writes, local, stdin)
+        return func
+    if handler is not None:
+        return decorator(handler)
+    return decorator
+
+def split_redirect(command_line):
+    """Отделяет перенаправление вывода: 'cmd > файл' -> ('cmd', 'файл', False), '>>' дает append=True"""
+    position = command_line.rfind('>')
+    if position < 0:
+        return command_line, None, False
+    append = position > 0 and command_line[position - 1] == '>'
+    command = command_line[:position - 1] if append else command_line[:position]
+    return command, command_line[position + 1:].strip(), append
+
+def command_writes(command_line):
+    """Может ли строка команды изменить VFS (time смотрит на вложенную команду, конвейер - на все)"""
+    if '>' in command_line:
+        return True  # перенаправление пишет в файл VFS
+    for stage in command_line.split('|'):
+        parts = stage.split()
+        while parts and parts[0] == 'time':
+            parts = parts[1:]
+        spec = COMMANDS.get(parts[0]) if parts else None
+        if spec is not None and spec.writes:
+            return True
+    return False
+
+class ScriptRunner:
+    """Выполняет скрипт построчно и порциями, не читая его целиком в память"""
+    def __init__(self, shell, script_path):
+        self.shell = shell
+        self.script_path = script_path
+        self.file = open(script_path, 'rb')
+        self.total_bytes = os.path.getsize(script_path)
+        self.done_bytes = 0
+        self.line_num = 0
+        self.paused = False
+        self.finished = False
+    
+    def progress(self):
+        """Доля уже прочитанного скрипта от 0 до 1"""
+        if not self.total_bytes:
+            return 1.0
+        return self.done_bytes / self.total_bytes
+    
+    def run_slice(self, budget=None):
+        """Выполняет строки, пока не истечет budget секунд (None - до конца); возвращает True, если строки остались"""
+        deadline = None if budget is None else time.perf_counter() + budget
+        shell = self.shell
+        while not self.finished and not self.paused:
+            if not shell.running:
+                self.close()
+                break
+            try:
+                raw = self.file.readline()
+            except Exception as e:
+                shell.print_output(f"Ошибка при чтении скрипта: {str(e)}\n")
+                self.close()
+                break
+            if not raw:
+                self.close()
+                break
+            self.done_bytes += len(raw)
+            self.line_num += 1
+            
+            try:
+                line = raw.decode('utf-8').strip()
+                if line and not line.startswith('#'):  # Пропускаем пустые строки и комментарии
+                    shell.print_output(f"[{shell.hostname} {shell.current_dir}]$ {line}\n")
+                    shell.execute_single_command(line)
+            except Exception as e:
+                shell.print_output(f"Ошибка в строке {self.line_num}: {str(e)}\n")
+            
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        return not self.finished
+    
+    def close(self):
+        self.finished = True
+        self.file.close()
+
+class Shell:
+    """Интерпретатор команд над VFS, не зависящий от интерфейса вывода"""
+    def __init__(self, vfs_path=None, script_path=None, load_workers=None, journal=False, watch=False, lazy=False,
+                 profile=None, vfs=None, connect=None):
         self.vfs_path = vfs_path
         self.script_path = script_path
         self.hostname = "maxim"
+        self.running = True
+        self.script_runner = None
+        self.input_stream = None  # поток, который читают команды без аргументов (rev)
+        self.cancel_event = None  # threading.Event, если команды можно прерывать
+        self.last_reload_check = time.monotonic()
         
-        # Загружаем VFS если указан путь
-        self.vfs = None
-        if self.vfs_path and os.path.exists(self.vfs_path):
+        # Замеры загрузки, команд и вывода; при profile отчет пишется при завершении ('-' - в stderr)
+        self.profiler = Profiler()
+        self.profile_path = profile
+        self.session_closed = False
+        
+        # Загружаем VFS если указан путь; с connect команды выполняет сервер VFS,
+        # а vfs передает уже загруженную VFS (сеанс на сервере)
+        self.vfs = vfs
+        self.client = None
+        if connect:
+            try:
+                self.client = VFSClient(connect)
+                print(f"DEBUG: Подключено к серверу VFS {connect}", file=sys.stderr)
+            except OSError as e:
+                print(f"DEBUG: Ошибка подключения к серверу VFS: {e}", file=sys.stderr)
+        elif self.vfs is not None:
+            pass
+        elif self.vfs_path and os.path.exists(self.vfs_path):
             try:
-                self.vfs = VFS(self.vfs_path)
-                print(f"DEBUG: VFS успешно создана из {self.vfs_path}")
+                start_wall, start_cpu = time.perf_counter(), time.process_time()
+                self.vfs = VFS(self.vfs_path, load_workers=load_workers, journal=journal, watch=watch, lazy=lazy)
+                wall = time.perf_counter() - start_wall
+                self.profiler.record('vfs_load', wall, time.process_time() - start_cpu)
+                print(f"DEBUG: VFS успешно создана из {self.vfs_path} за {wall:.3f} с", file=sys.stderr)
             except Exception as e:
-                print(f"DEBUG: Ошибка загрузки VFS: {e}")
+                print(f"DEBUG: Ошибка загрузки VFS: {e}", file=sys.stderr)
                 self.vfs = None
         else:
-            print(f"DEBUG: VFS path не существует или не указан: {self.vfs_path}")
-        
-        self.current_dir = '/' 
+            print(f"DEBUG: VFS path не существует или не указан: {self.vfs_path}", file=sys.stderr)
         
-        print(f"DEBUG: VFS path: {self.vfs_path}")
-        print(f"DEBUG: Script path: {self.script_path}")
-        print(f"DEBUG: VFS loaded: {self.vfs is not None}")
-        
-        self.root.title(f"Эмулятор - [{self.hostname}]")
-        self.root.configure(bg='#2d2d2d')
-
-        self.output_text = scrolledtext.ScrolledText(root, wrap=tk.WORD, state='disabled', bg='#14213D', fg='#E5E5E5', font=('Times New Roman', 14))
-        self.output_text.pack(expand=True, fill='both', padx=10, pady=10)
-        
-        self.input_frame = tk.Frame(root)
-        self.input_frame.pack(fill='x', padx=10, pady=(0, 10))
-        
-        self.prompt_label = tk.Label(self.input_frame, text=f"[{self.hostname} {self.current_dir}]$", font=('Times New Roman', 14), fg="#412B07")
-        self.prompt_label.pack(side='left')
-        
-        self.command_entry = tk.Entry(self.input_frame, font=('Times New Roman', 14), fg='#E5E5E5', bg='#14213D')
-        self.command_entry.pack(side='left', fill='x', expand=True)
-        self.command_entry.bind('<Return>', self.process_command)
-
-        self.print_output("Эмулятор терминала запущен!\n")
-        if self.vfs:
-            self.print_output("VFS загружена.\n")
-        else:
-            self.print_output("VFS не загружена.\n")
-        self.print_output("Команды: ls, cd, cat, date, rev, chown, exit\n")
-        self.print_output("Введите 'exit' для выхода из программы.\n\n")
+        self.current_dir = self.client.current_dir if self.client else '/'
         
-        if self.script_path:
-            self.execute_script(self.script_path)
+        if vfs is None:  # сеансы сервера получают уже загруженную VFS - сообщать о загрузке нечего
+            print(f"DEBUG: VFS path: {self.vfs_path}", file=sys.stderr)
+            print(f"DEBUG: Script path: {self.script_path}", file=sys.stderr)
+            print(f"DEBUG: VFS loaded: {self.vfs is not None}", file=sys.stderr)
     
     def print_output(self, text):
-        self.output_text.config(state='normal')
-        self.output_text.insert(END, text)
-        self.output_text.config(state='disabled')
-        self.output_text.see(END)
+        raise NotImplementedError
+    
+    def flush_output(self):
+        """Доводит накопленный вывод до получателя"""
+        pass
+    
+    def check_cancelled(self):
+        """Точка прерывания: выбрасывает CommandCancelled, если команду попросили остановить"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise CommandCancelled()
     
     def update_prompt(self):
-        self.prompt_label.config(text=f"[{self.hostname} {self.current_dir}]$")
+        pass
+    
+    def check_reload(self):
+        """Применяет изменения CSV, не закрывая сеанс"""
+        self.last_reload_check = time.monotonic()
+        snapshots = len(self.vfs.checkpoints)  # при изменении CSV снимки сбрасываются
+        try:
+            result = self.vfs.reload_if_changed()
+        except Exception as e:
+            self.print_output(f"Ошибка обновления VFS: {e}\n")
+            return
+        if not result or result == (0, 0):
+            return
+        self.print_output(f"VFS обновлена: строк добавлено/изменено {result[0]}, удалено {result[1]}\n")
+        if snapshots:
+            self.print_output(f"Снимки ({snapshots}) удалены: откатить изменения CSV нельзя\n")
+        node = self.vfs.get_node(self.current_dir)
+        if not node or not node.is_directory:
+            self.print_output(f"Текущая директория {self.current_dir} удалена, переход в /\n")
+            self.current_dir = '/'
+            self.update_prompt()
     
     def execute_script(self, script_path):
         """Выполняет команды из стартового скрипта"""
+        if self.start_script(script_path):
+            self.schedule_script()
+    
+    def start_script(self, script_path):
+        """Открывает скрипт для построчного выполнения"""
         if not os.path.exists(script_path):
             self.print_output(f"Ошибка: файл скрипта не найден - {script_path}\n")
-            return
-        
+            return None
         try:
-            with open(script_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            for line_num, line in enumerate(lines, 1):
-                line = line.strip()
-                if not line or line.startswith('#'):  # Пропускаем пустые строки и комментарии
-                    continue
-                
-                try:
-                    self.print_output(f"[{self.hostname} {self.current_dir}]$ {line}\n")
-                    self.execute_single_command(line)
-                except Exception as e:
-                    self.print_output(f"Ошибка в строке {line_num}: {str(e)}\n")
-                    continue
+            self.script_runner = ScriptRunner(self, script_path)
         except Exception as e:
             self.print_output(f"Ошибка при чтении скрипта: {str(e)}\n")
+            return None
+        return self.script_runner
+    
+    def schedule_script(self):
+        """Продолжает выполнение скрипта; без цикла событий - сразу до конца"""
+        self.script_runner.run_slice()
     
     def execute_single_command(self, command_line):
         if not command_line.strip():
@@ -204,38 +1639,158 @@ class TerminalEmulator:
         command = parts[0]
         args = parts[1:] if len(parts) > 1 else []
         
-        if command == "exit":
-            self.exit_command(args)
-        elif command == "ls":
-            self.ls_command(args)
-        elif command == "cd":
-            self.cd_command(args)
-        elif command == "cat":
-            self.cat_command(args)
-        elif command == "date":
-            self.date_command(args)
-        elif command == "rev":
-            self.rev_command(args)
-        elif command == "chown":
-            self.chown_command(args)
-        else:
+        if self.vfs and self.vfs.watch_path and (time.monotonic() - self.last_reload_check) * 1000 >= RELOAD_POLL_MS:
+            self.check_reload()
+        
+        spec = COMMANDS.get(command)
+        if self.client is not None and (spec is None or not spec.local):
+            self.run_timed(command, self.execute_remote, command_line)
+            return
+        if ('|' in command_line or '>' in command_line) and command != 'time':  # time замеряет строку целиком
+            self.run_timed('pipeline', self.execute_pipeline, command_line)
+            return
+        if not self.check_command(spec, command, args):
+            return
+        input_chunks = None
+        if spec.stdin and self.input_stream is not None:
+            input_chunks = iter_stream_chunks(self.input_stream)
+        self.run_timed(command, self.write_output, self.command_output(spec, args, input_chunks))
+    
+    def check_command(self, spec, command, args):
+        """Проверяет, что команда существует и может быть выполнена с такими аргументами"""
+        if spec is None:
             self.print_output(f"Команда не найдена: {command}\n")
+            return False
+        if spec.needs_vfs and not self.vfs:
+            self.print_output("VFS не загружена\n")
+            return False
+        if len(args) < spec.min_args or (spec.max_args is not None and len(args) > spec.max_args):
+            self.print_output(f"{command}: неверное число аргументов\n")
+            if spec.usage:
+                self.print_output(f"Использование: {spec.usage}\n")
+            return False
+        return True
     
-    def process_command(self, event=None):
-        command_line = self.command_entry.get()
-        self.command_entry.delete(0, END)
-        
-        self.print_output(f"[{self.hostname} {self.current_dir}]$ {command_line}\n")
-        
-        if not command_line.strip():
+    def command_output(self, spec, args, input_chunks=None, piped=False):
+        """Итератор порций вывода команды. Обработчики-генераторы отдают вывод порциями,
+        остальные пишут свои сообщения сразу через print_output.
+        piped - вход идет от команд левее в конвейере, а не из потока ввода"""
+        if spec.stdin:
+            output = spec.handler(self, args, input_chunks)
+        else:
+            if piped:
+                for _ in input_chunks:
+                    pass  # вход команде не нужен, но команды левее должны выполниться
+            output = spec.handler(self, args)
+        if output is not None:
+            yield from output
+        if piped and spec.stdin:
+            for _ in input_chunks:
+                pass  # команда с файлом в аргументах вход не читала
+    
+    def write_output(self, chunks):
+        for chunk in chunks:
+            self.print_output(chunk)
+    
+    def execute_pipeline(self, command_line):
+        """Выполняет конвейер a | b | c [> файл]: вывод каждой команды порциями идет на вход следующей,
+        так что объем памяти не зависит от размера данных"""
+        command_line, target, append = split_redirect(command_line)
+        if target is not None and (not target or len(target.split()) > 1 or '|' in target):
+            self.print_output("Ошибка: после > ожидается одно имя файла\n")
             return
+        stages = []
+        for stage in command_line.split('|'):
+            parts = stage.split()
+            if not parts:
+                self.print_output("Ошибка: пустая команда в конвейере\n")
+                return
+            spec = COMMANDS.get(parts[0])
+            if not self.check_command(spec, parts[0], parts[1:]):
+                return
+            stages.append((spec, parts[1:]))
         
-        self.execute_single_command(command_line)
+        chunks = None
+        if stages[0][0].stdin and self.input_stream is not None:
+            chunks = iter_stream_chunks(self.input_stream)
+        for index, (spec, args) in enumerate(stages):
+            chunks = self.command_output(spec, args, chunks, piped=index > 0)
+        if target is None:
+            self.write_output(chunks)
+        else:
+            self.write_to_file(chunks, target, append)
     
-    def ls_command(self, args):
+    def write_to_file(self, chunks, target, append):
+        """Направляет вывод команды в файл VFS"""
         if not self.vfs:
             self.print_output("VFS не загружена\n")
             return
+        path = target if target.startswith('/') else self.resolve_path(target)
+        parent = self.vfs.get_node(path.rsplit('/', 1)[0] or '/')
+        if not parent or not parent.is_directory:
+            self.print_output(f"Директория не найдена: {path.rsplit('/', 1)[0]}\n")
+            return
+        if not self.vfs.write_file_chunks(path, self.cancellable(chunks), append):
+            self.print_output(f"Это директория: {path}\n")
+    
+    def cancellable(self, chunks):
+        """Пропускает порции, проверяя между ними, не прервана ли команда"""
+        for chunk in chunks:
+            self.check_cancelled()
+            yield chunk
+    
+    def run_timed(self, command, func, *args):
+        """Выполняет обработчик команды, записывая его время в профиль"""
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        interruptible = self.vfs is not None and self.cancel_event is not None
+        if interruptible:
+            self.vfs.interrupt.check = self.check_cancelled  # прерывать можно и внутри обходов VFS
+        try:
+            func(*args)
+        except CommandCancelled:
+            pass  # о прерывании сообщает тот, кто его запросил
+        finally:
+            if interruptible:
+                self.vfs.interrupt.check = None
+            self.profiler.record(f"cmd:{command}", time.perf_counter() - start_wall, time.process_time() - start_cpu)
+    
+    def execute_remote(self, command_line):
+        """Передает команду серверу VFS и выводит ответ по мере поступления"""
+        client = self.client
+        client.send({'op': 'command', 'line': command_line})
+        cancelled = False
+        while True:
+            message = client.receive(REMOTE_POLL_S)
+            if message is None:
+                if not cancelled and self.cancel_event is not None and self.cancel_event.is_set():
+                    client.send({'op': 'cancel'})
+                    cancelled = True
+                continue
+            if 'output' in message:
+                if cancelled:
+                    continue  # остаток вывода прерванной команды
+                try:
+                    self.print_output(message['output'])
+                except CommandCancelled:
+                    client.send({'op': 'cancel'})
+                    cancelled = True
+            elif 'error' in message:
+                self.print_output(f"Ошибка сервера VFS: {message['error']}\n")
+                return
+            elif 'done' in message:
+                if message['cwd'] != self.current_dir:
+                    self.current_dir = message['cwd']
+                    self.update_prompt()
+                if not message['running']:
+                    self.running = False
+                    self.on_exit()
+                return
+    
+    @register_command('ls', usage='ls [-l] [путь]', needs_vfs=True)
+    def ls_command(self, args):
+        long_format = bool(args) and args[0] == '-l'
+        if long_format:
+            args = args[1:]
         
         target_dir = self.current_dir
         if args:
@@ -244,18 +1799,18 @@ class TerminalEmulator:
             else:
                 target_dir = self.resolve_path(args[0])
         
-        contents = self.vfs.list_directory(target_dir)
+        if long_format:
+            entries = self.vfs.list_directory_long(target_dir)
+            contents = [f"{'d' if is_dir else '-'} {owner:<10} {group:<10} {name}" for name, is_dir, owner, group in entries]
+        else:
+            contents = self.vfs.list_directory(target_dir)
         if contents:
-            for item in contents:
-                self.print_output(f"{item}\n")
+            yield '\n'.join(contents) + '\n'
         else:
             self.print_output("Директория пуста или не существует\n")
     
+    @register_command('cd', usage='cd [путь]', needs_vfs=True)
     def cd_command(self, args):
-        if not self.vfs:
-            self.print_output("VFS не загружена\n")
-            return
-        
         if not args:
             self.current_dir = '/'
             self.update_prompt()
@@ -275,77 +1830,138 @@ class TerminalEmulator:
         else:
             self.print_output(f"Директория не найдена: {new_path}\n")
     
-    def cat_command(self, args):
-        if not self.vfs:
-            self.print_output("VFS не загружена\n")
-            return
-        
+    @register_command('cat', usage='cat [файл]', needs_vfs=True, stdin=True)
+    def cat_command(self, args, input_chunks=None):
         if not args:
-            self.print_output("cat: отсутствует имя файла\n")
+            if input_chunks is None:
+                self.print_output("cat: отсутствует имя файла\n")
+                return
+            yield from input_chunks  # cat без файла передает вход дальше
             return
         
         file_path = args[0]
         if not file_path.startswith('/'):
             file_path = self.resolve_path(file_path)
         
-        content = self.vfs.read_file(file_path)
-        if content is not None:
-            self.print_output(f"{content}\n")
+        chunks = self.vfs.read_file_chunks(file_path)
+        if chunks is not None:
+            yield from chunks
+            yield "\n"
         else:
             self.print_output(f"Файл не найден: {file_path}\n")
     
+    @register_command('date', usage='date [+%s|+%Y-%m-%d|+%H:%M:%S]')
     def date_command(self, args):
         current_time = datetime.datetime.now()
         if args and args[0] == '+%s':
             # Формат Unix timestamp
             timestamp = int(current_time.timestamp())
-            self.print_output(f"{timestamp}\n")
+            yield f"{timestamp}\n"
         elif args and args[0] == '+%Y-%m-%d':
             # Формат YYYY-MM-DD
-            self.print_output(f"{current_time.strftime('%Y-%m-%d')}\n")
+            yield f"{current_time.strftime('%Y-%m-%d')}\n"
         elif args and args[0] == '+%H:%M:%S':
             # Формат HH:MM:SS
-            self.print_output(f"{current_time.strftime('%H:%M:%S')}\n")
+            yield f"{current_time.strftime('%H:%M:%S')}\n"
         else:
             # Стандартный формат
-            self.print_output(f"{current_time.strftime('%a %b %d %H:%M:%S %Y')}\n")
+            yield f"{current_time.strftime('%a %b %d %H:%M:%S %Y')}\n"
     
-    def rev_command(self, args):
-        if not args:
-            # Если нет аргументов, ждем ввода с клавиатуры (упрощенная версия)
-            self.print_output("rev: ожидается текст или имя файла\n")
+    @register_command('rev', usage='rev [текст|файл|-]', stdin=True)
+    def rev_command(self, args, input_chunks=None):
+        if not args or args == ['-']:
+            if input_chunks is None:
+                self.print_output("rev: ожидается текст или имя файла\n")
+                return
+            # Читаем вход (конвейер или stdin в режиме --headless) порциями
+            yield from reverse_lines(input_chunks, empty_tail=False)
             return
         
         input_text = ' '.join(args)
         
         # Проверяем, является ли первый аргумент именем файла в VFS
         if self.vfs:
-            file_content = self.vfs.read_file(input_text)
-            if file_content is not None:
-                # Реверсируем каждую строку файла
-                lines = file_content.split('\n')
-                reversed_lines = [line[::-1] for line in lines]
-                self.print_output('\n'.join(reversed_lines) + '\n')
+            file_path = input_text if input_text.startswith('/') else self.resolve_path(input_text)
+            chunks = self.vfs.read_file_chunks(file_path)
+            if chunks is not None:
+                # Реверсируем каждую строку файла, не собирая его целиком
+                yield from reverse_lines(chunks)
                 return
         
         # Реверсируем текстовые аргументы
         reversed_text = input_text[::-1]
-        self.print_output(f"{reversed_text}\n")
+        yield f"{reversed_text}\n"
     
-    def chown_command(self, args):
-        if not self.vfs:
-            self.print_output("VFS не загружена\n")
+    @register_command('find', usage='find [путь] [-name шаблон] [-type f|d]', needs_vfs=True)
+    def find_command(self, args):
+        start = self.current_dir
+        pattern = None
+        node_type = None
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in ('-name', '-type'):
+                if i + 1 >= len(args):
+                    self.print_output(f"find: отсутствует значение для {arg}\n")
+                    return
+                if arg == '-name':
+                    pattern = args[i + 1]
+                elif args[i + 1] in ('f', 'd'):
+                    node_type = args[i + 1]
+                else:
+                    self.print_output(f"find: неизвестный тип: {args[i + 1]}\n")
+                    return
+                i += 2
+            elif i == 0 and not arg.startswith('-'):
+                start = arg if arg.startswith('/') else self.resolve_path(arg)
+                i += 1
+            else:
+                self.print_output(f"find: неизвестный параметр: {arg}\n")
+                return
+        
+        results = self.vfs.find(start, pattern, node_type)
+        if results is None:
+            self.print_output(f"find: путь не найден: {start}\n")
+        elif results:
+            yield '\n'.join(results) + '\n'
+    
+    @register_command('snapshot', max_args=0, usage='snapshot', needs_vfs=True, writes=True)
+    def snapshot_command(self, args):
+        number = self.vfs.snapshot()
+        self.print_output(f"Снимок {number} создан\n")
+    
+    @register_command('rollback', max_args=1, usage='rollback [номер снимка]', needs_vfs=True, writes=True)
+    def rollback_command(self, args):
+        number = None
+        if args:
+            if not args[0].isdigit():
+                self.print_output(f"rollback: неверный номер снимка: {args[0]}\n")
+                return
+            number = int(args[0])
+        if not self.vfs.rollback(number):
+            self.print_output("rollback: снимок не найден\n")
             return
+        node = self.vfs.get_node(self.current_dir)
+        if not node or not node.is_directory:
+            self.current_dir = '/'
+            self.update_prompt()
+        self.print_output(f"Состояние VFS восстановлено из снимка {number or len(self.vfs.checkpoints)}\n")
+    
+    @register_command('chown', usage='chown [-R] owner[:group] файл', needs_vfs=True, writes=True)
+    def chown_command(self, args):
+        recursive = bool(args) and args[0] == '-R'
+        if recursive:
+            args = args[1:]
         
         if not args:
             self.print_output("chown: отсутствуют аргументы\n")
-            self.print_output("Использование: chown owner[:group] файл\n")
+            self.print_output("Использование: chown [-R] owner[:group] файл\n")
             return
         
         owner_group = args[0]
         if len(args) < 2:
             self.print_output("chown: отсутствует имя файла\n")
-            self.print_output("Использование: chown owner[:group] файл\n")
+            self.print_output("Использование: chown [-R] owner[:group] файл\n")
             return
         
         target_path = args[1]
@@ -362,12 +1978,50 @@ class TerminalEmulator:
             target_path = self.resolve_path(target_path)
         
         # Изменяем владельца
-        success = self.vfs.change_owner(target_path, owner, group)
+        success = self.vfs.change_owner(target_path, owner, group, recursive)
         if success:
             self.print_output(f"Владелец изменен для {target_path}\n")
         else:
             self.print_output(f"Файл/директория не найден: {target_path}\n")
     
+    def complete(self, text):
+        """Дополняет последнее слово строки: имя команды или путь VFS.
+        Возвращает (новая строка, варианты); варианты выдаются, когда дополнение неоднозначно"""
+        start = max(text.rfind(' '), text.rfind('|'), text.rfind('>')) + 1
+        head, word = text[:start], text[start:]
+        stage = head.rsplit('|', 1)[-1].split()
+        if all(part == 'time' for part in stage):
+            # Первое слово команды, конвейера или после time - дополняем имя команды
+            names = [name for name in sorted(COMMANDS) if name.startswith(word)]
+            if len(names) == 1:
+                return head + names[0] + ' ', []
+            common = os.path.commonprefix(names) if names else word
+            if len(common) > len(word):
+                return head + common, []
+            return text, names
+        
+        source = self.vfs or self.client
+        if source is None:
+            return text, []
+        directory_part, slash, prefix = word.rpartition('/')
+        if not slash:
+            directory = self.current_dir
+        elif word.startswith('/'):
+            directory = directory_part or '/'
+        else:
+            directory = self.resolve_path(directory_part) or '/'  # выше корня подниматься некуда
+        matches, common, total = source.complete_names(directory, prefix, COMPLETION_LIMIT)
+        base = head + directory_part + slash
+        if total == 1:
+            name, is_dir = matches[0]
+            return base + name + ('/' if is_dir else ' '), []
+        if len(common) > len(prefix):
+            return base + common, []
+        candidates = [name + '/' if is_dir else name for name, is_dir in matches]
+        if total > len(candidates):
+            candidates.append(f"... (всего {total})")
+        return text, candidates
+    
     def resolve_path(self, relative_path):
 
         if relative_path == '..':
@@ -395,21 +2049,727 @@ class TerminalEmulator:
             else:
                 return f"{self.current_dir}/{relative_path}"
     
+    @register_command('script', min_args=1, max_args=1, usage='script status|pause|resume|cancel', local=True)
+    def script_command(self, args):
+        runner = self.script_runner
+        if runner is None or runner.finished:
+            self.print_output("script: скрипт не выполняется\n")
+            return
+        
+        action = args[0]
+        if action == 'status':
+            state = "приостановлен" if runner.paused else "выполняется"
+            self.print_output(f"{runner.script_path}: {state}, строка {runner.line_num}, {runner.progress():.0%}\n")
+        elif action == 'pause':
+            runner.paused = True
+        elif action == 'resume':
+            if runner.paused:
+                runner.paused = False
+                self.schedule_script()
+        elif action == 'cancel':
+            runner.close()
+            self.print_output(f"Скрипт {runner.script_path} остановлен на строке {runner.line_num}\n")
+        else:
+            self.print_output("Использование: script status|pause|resume|cancel\n")
+    
+    @register_command('time', min_args=1, usage='time команда [аргументы]')
+    def time_command(self, args):
+        output_before = self.profiler.total('output')
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        self.execute_single_command(' '.join(args))
+        self.flush_output()  # вывод команды входит в замер
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        output = self.profiler.total('output') - output_before
+        self.print_output(f"\nreal    {wall:.6f}s\ncpu     {cpu:.6f}s\noutput  {output:.6f}s\n")
+    
+    @register_command('exit', usage='exit')
     def exit_command(self, args):
+        self.running = False
+        self.on_exit()
+    
+    def on_exit(self):
+        self.close_session()
+    
+    def close_session(self):
+        """Закрывает VFS и выводит отчет --profile; повторные вызовы ничего не делают"""
+        if self.session_closed:
+            return
+        self.session_closed = True
+        if self.vfs:
+            self.vfs.close()
+        if self.client:
+            self.client.close()
+        if self.profile_path:
+            report = self.profiler.report()
+            if self.profile_path == '-':
+                sys.stderr.write(report)
+            else:
+                with open(self.profile_path, 'w', encoding='utf-8') as f:
+                    f.write(report)
+
+class TerminalEmulator(Shell):
+    """Графический терминал на tkinter"""
+    def __init__(self, root, vfs_path=None, script_path=None, output_latency_ms=DEFAULT_OUTPUT_LATENCY_MS,
+                 scrollback_lines=DEFAULT_SCROLLBACK_LINES, transcript_path=None, script_slice_ms=DEFAULT_SCRIPT_SLICE_MS,
+                 load_workers=None, journal=False, watch=False, lazy=False, profile=None,
+                 command_timeout=DEFAULT_COMMAND_TIMEOUT_S, connect=None):
+        # tkinter импортируется только графическим режимом, см. HeadlessTerminal
+        import tkinter as tk
+        from tkinter import scrolledtext
+        
+        self.root = root
+        
+        # Буфер вывода, сбрасываемый в виджет не чаще раза за output_latency_ms
+        self.output_latency_ms = output_latency_ms
+        self.output_buffer = deque()  # пополняется и потоком команды, поэтому deque
+        self.flush_job = None
+        
+        # Ограничение истории вывода; вытесненные строки дописываются в transcript_path
+        self.scrollback_lines = scrollback_lines
+        self.transcript_path = transcript_path
+        self.transcript_file = None
+        
+        # Скрипт выполняется порциями по script_slice_ms между событиями окна
+        self.script_slice_ms = script_slice_ms
+        self.script_job = None
+        
+        # Введенные команды выполняются задачами asyncio в отдельном потоке; цикл asyncio
+        # прокручивается из цикла Tk (frame_tick), пока есть выполняющаяся команда
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='command')
+        self.command_timeout = command_timeout
+        self.command_task = None
+        self.frame_job = None
+        
+        super().__init__(vfs_path, script_path, load_workers, journal, watch, lazy, profile, connect=connect)
+        self.cancel_event = threading.Event()
+        
+        self.root.title(f"Эмулятор - [{self.hostname}]")
+        self.root.configure(bg='#2d2d2d')
+
+        self.output_text = scrolledtext.ScrolledText(root, wrap=tk.WORD, state='disabled', bg='#14213D', fg='#E5E5E5', font=('Times New Roman', 14))
+        self.output_text.pack(expand=True, fill='both', padx=10, pady=10)
+        
+        self.input_frame = tk.Frame(root)
+        self.input_frame.pack(fill='x', padx=10, pady=(0, 10))
+        
+        self.prompt_label = tk.Label(self.input_frame, text=f"[{self.hostname} {self.current_dir}]$", font=('Times New Roman', 14), fg="#412B07")
+        self.prompt_label.pack(side='left')
+        
+        self.command_entry = tk.Entry(self.input_frame, font=('Times New Roman', 14), fg='#E5E5E5', bg='#14213D')
+        self.command_entry.pack(side='left', fill='x', expand=True)
+        self.command_entry.bind('<Return>', self.process_command)
+        self.command_entry.bind('<Control-c>', self.interrupt_command)
+        self.command_entry.bind('<Tab>', self.complete_command)
+        self.root.protocol("WM_DELETE_WINDOW", self.close_window)
+        if self.vfs and self.vfs.journal is not None:
+            self.root.after(JOURNAL_GROUP_MS, self.journal_tick)
+        if self.vfs and self.vfs.watch_path:
+            self.root.after(RELOAD_POLL_MS, self.reload_tick)
+
+        self.print_output("Эмулятор терминала запущен!\n")
+        if self.vfs:
+            self.print_output("VFS загружена.\n")
+        elif self.client:
+            self.print_output(f"Подключено к серверу VFS {connect}.\n")
+        else:
+            self.print_output("VFS не загружена.\n")
+        self.print_output(f"Команды: {', '.join(COMMANDS)}\n")
+        self.print_output("Введите 'exit' для выхода из программы.\n\n")
+        
+        if self.script_path:
+            self.execute_script(self.script_path)
+    
+    def schedule_script(self):
+        if not self.in_ui_thread():
+            self.call_in_ui(self.schedule_script)  # script resume выполняется в потоке команды
+            return
+        if self.script_job is None:
+            self.script_job = self.root.after(1, self.script_tick)
+    
+    def script_tick(self):
+        """Выполняет очередную порцию скрипта и планирует следующую"""
+        self.script_job = None
+        runner = self.script_runner
+        if self.command_task is not None:
+            # Пока введенная команда работает в фоне, скрипт ждет, чтобы не трогать VFS одновременно с ней
+            self.script_job = self.root.after(FRAME_MS, self.script_tick)
+            return
+        if runner.run_slice(self.script_slice_ms / 1000):
+            if not runner.paused:
+                self.schedule_script()
+            self.root.title(f"Эмулятор - [{self.hostname}] - скрипт {runner.progress():.0%}")
+        else:
+            self.root.title(f"Эмулятор - [{self.hostname}]")
+    
+    def in_ui_thread(self):
+        return threading.current_thread() is threading.main_thread()
+    
+    def call_in_ui(self, func, *args):
+        """Выполняет func в потоке окна: сразу или на ближайшем кадре, если вызвана из потока команды"""
+        if self.in_ui_thread():
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+    
+    def print_output(self, text):
+        if not self.in_ui_thread():
+            self.check_cancelled()  # вывод из потока команды - точка прерывания
+            self.output_buffer.append(text)
+            return  # в окно текст перенесет frame_tick
+        self.output_buffer.append(text)
+        if self.flush_job is None:
+            if self.output_latency_ms > 0:
+                self.flush_job = self.root.after(self.output_latency_ms, self.flush_output)
+            else:
+                self.flush_job = self.root.after_idle(self.flush_output)
+    
+    def flush_output(self):
+        """Вставляет накопленный вывод в виджет одной операцией"""
+        if not self.in_ui_thread():
+            # Поток команды ждет, пока окно вставит вывод: иначе time не учтет его время
+            done = threading.Event()
+            self.call_in_ui(self.flush_and_signal, done)
+            while not done.wait(REMOTE_POLL_S):
+                self.check_cancelled()
+            return
+        if self.flush_job is not None:
+            self.root.after_cancel(self.flush_job)
+            self.flush_job = None
+        if not self.output_buffer:
+            return
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        buffer = self.output_buffer
+        text = ''.join([buffer.popleft() for _ in range(len(buffer))])
+        self.output_text.config(state='normal')
+        self.output_text.insert(END, text)
+        self.trim_scrollback()
+        self.output_text.config(state='disabled')
+        self.output_text.see(END)
+        self.profiler.record('output', time.perf_counter() - start_wall, time.process_time() - start_cpu)
+    
+    def flush_and_signal(self, done):
+        try:
+            self.flush_output()
+        finally:
+            done.set()
+    
+    def trim_scrollback(self):
+        """Удаляет самые старые строки, если окно вывода превысило лимит"""
+        if not self.scrollback_lines:
+            return
+        line_count = int(self.output_text.index('end-1c').split('.')[0])
+        if line_count <= self.scrollback_lines * (1 + SCROLLBACK_SLACK):
+            return
+        cut = f"{line_count - self.scrollback_lines + 1}.0"
+        if self.transcript_path:
+            if self.transcript_file is None:
+                self.transcript_file = open(self.transcript_path, 'a', encoding='utf-8')
+            self.transcript_file.write(self.output_text.get('1.0', cut))
+            self.transcript_file.flush()
+        self.output_text.delete('1.0', cut)
+    
+    def update_prompt(self):
+        if not self.in_ui_thread():
+            self.call_in_ui(self.update_prompt)
+            return
+        self.prompt_label.config(text=f"[{self.hostname} {self.current_dir}]$")
+    
+    def process_command(self, event=None):
+        if not self.running:
+            return  # после exit VFS уже закрыта, окно вот-вот закроется
+        if self.command_task is not None:
+            self.print_output("Предыдущая команда еще выполняется (Ctrl-C - прервать)\n")
+            return
+        command_line = self.command_entry.get()
+        self.command_entry.delete(0, END)
+        
+        self.print_output(f"[{self.hostname} {self.current_dir}]$ {command_line}\n")
+        
+        if not command_line.strip():
+            return
+        
+        self.command_task = self.loop.create_task(self.run_command(command_line))
+        self.schedule_frame()
+    
+    async def run_command(self, command_line):
+        """Выполняет команду в потоке, ограничивая время command_timeout и реагируя на Ctrl-C"""
+        self.cancel_event.clear()
+        worker = self.loop.run_in_executor(self.executor, self.execute_single_command, command_line)
+        try:
+            await asyncio.wait_for(asyncio.shield(worker), self.command_timeout or None)
+        except asyncio.TimeoutError:
+            self.print_output(f"Превышено время выполнения ({self.command_timeout} с), команда прервана\n")
+            await self.stop_worker(worker)
+        except asyncio.CancelledError:
+            self.print_output("^C\n")
+            await self.stop_worker(worker)
+        except Exception as e:
+            self.print_output(f"Ошибка выполнения команды: {e}\n")
+        finally:
+            self.command_task = None
+    
+    async def stop_worker(self, worker):
+        """Просит поток команды остановиться и дожидается, пока он дойдет до точки прерывания"""
+        self.cancel_event.set()
+        try:
+            await worker
+        except Exception as e:
+            self.print_output(f"Ошибка выполнения команды: {e}\n")
+        finally:
+            self.cancel_event.clear()  # поток остановлен: скрипт в окне не должен принять запрос на свой счет
+    
+    def complete_command(self, event=None):
+        """Tab: дополняет имя команды или путь в строке ввода"""
+        if self.command_task is not None:
+            return 'break'  # VFS (или соединение с сервером) сейчас занята командой
+        text = self.command_entry.get()
+        completed, candidates = self.complete(text)
+        if completed != text:
+            self.command_entry.delete(0, END)
+            self.command_entry.insert(0, completed)
+            self.command_entry.icursor(END)
+        if candidates:
+            self.print_output('  '.join(candidates) + '\n')
+        return 'break'  # Tab не должен переводить фокус
+    
+    def interrupt_command(self, event=None):
+        """Ctrl-C: прерывает выполняющуюся команду, а без нее - стартовый скрипт"""
+        if self.command_task is not None:
+            self.command_task.cancel()
+            self.schedule_frame()
+            return 'break'
+        runner = self.script_runner
+        if runner is not None and not runner.finished:
+            runner.close()
+            self.print_output(f"^C\nСкрипт {runner.script_path} остановлен на строке {runner.line_num}\n")
+            return 'break'
+        return None  # обычное копирование выделенного текста
+    
+    def schedule_frame(self):
+        if self.frame_job is None:
+            self.frame_job = self.root.after(FRAME_MS, self.frame_tick)
+    
+    def frame_tick(self):
+        """Кадр окна: обработать готовые события asyncio и показать вывод фоновой команды"""
+        self.frame_job = None
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        self.flush_output()
+        if self.command_task is not None:
+            self.schedule_frame()
+    
+    def journal_tick(self):
+        """Сбрасывает на диск записи журнала, накопившиеся без новых изменений"""
+        if self.vfs.journal is not None:
+            if self.command_task is None:
+                self.vfs.journal.flush()
+            self.root.after(JOURNAL_GROUP_MS, self.journal_tick)
+    
+    def reload_tick(self):
+        """Периодически проверяет, не изменился ли CSV"""
+        if self.command_task is None:
+            self.check_reload()
+        self.root.after(RELOAD_POLL_MS, self.reload_tick)
+    
+    def stop_commands(self):
+        """Прерывает фоновую команду и дожидается ее потока перед закрытием VFS"""
+        self.cancel_event.set()
+        task = self.command_task
+        if task is not None:
+            task.cancel()
+            self.loop.run_until_complete(asyncio.wait([task]))
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.loop.close()
+    
+    def close_window(self):
+        self.stop_commands()
+        self.close_session()
+        self.root.destroy()
+    
+    def on_exit(self):
+        if not self.in_ui_thread():
+            self.call_in_ui(self.on_exit)  # exit выполнялась в потоке команды
+            return
+        super().on_exit()
+        self.flush_output()
+        if self.transcript_file is not None:
+            self.transcript_file.close()
+            self.transcript_file = None
         self.root.after(1000, self.root.destroy)
 
+class HeadlessTerminal(Shell):
+    """Терминал без графического интерфейса: вывод идет в stdout, tkinter не загружается"""
+    def __init__(self, vfs_path=None, script_path=None, output=None, load_workers=None, journal=False, watch=False,
+                 lazy=False, profile=None, connect=None):
+        super().__init__(vfs_path, script_path, load_workers, journal, watch, lazy, profile, connect=connect)
+        self.output = output or sys.stdout
+        if script_path:
+            # Команды идут из скрипта, поэтому stdin свободен для данных: rev -
+            self.input_stream = sys.stdin
+    
+    def print_output(self, text):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        self.output.write(text)
+        self.profiler.record('output', time.perf_counter() - start_wall, time.process_time() - start_cpu)
+    
+    def flush_output(self):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        self.output.flush()
+        self.profiler.record('output', time.perf_counter() - start_wall, time.process_time() - start_cpu)
+    
+    def run(self):
+        """Выполняет стартовый скрипт, а без него - команды из stdin"""
+        if self.script_path:
+            self.execute_script(self.script_path)
+        else:
+            for line in sys.stdin:
+                self.execute_single_command(line)
+                if not self.running:
+                    break
+        self.flush_output()
+        self.close_session()
+
+class ReadWriteLock:
+    """Блокировка asyncio: читатели работают одновременно, писатель - один.
+    Ожидающий писатель не пропускает вперед новых читателей"""
+    def __init__(self):
+        self.condition = asyncio.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+    
+    @contextlib.asynccontextmanager
+    async def read(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writer and not self.waiting_writers)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+    
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self.condition:
+            self.waiting_writers += 1
+            try:
+                await self.condition.wait_for(lambda: not self.writer and not self.readers)
+            finally:
+                self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+class SharedVFS:
+    """VFS, общая для потоков сервера: каждый вызов метода (и каждая порция итератора) идет под мьютексом,
+    так как даже чтение обновляет кэши и достраивает ленивые директории"""
+    def __init__(self, vfs):
+        self.vfs = vfs
+        self.mutex = threading.RLock()
+    
+    def __getattr__(self, name):
+        value = getattr(self.vfs, name)
+        if not callable(value):
+            return value
+        def call(*args, **kwargs):
+            with self.mutex:
+                result = value(*args, **kwargs)
+            if hasattr(result, '__next__'):
+                return self.iterate(result)
+            return result
+        return call
+    
+    def iterate(self, iterator):
+        while True:
+            with self.mutex:
+                item = next(iterator, None)
+            if item is None:
+                return
+            yield item
+
+class ServerSession(Shell):
+    """Сеанс клиента на сервере VFS: свой current_dir, вывод уходит в сокет клиента"""
+    def __init__(self, server, writer):
+        super().__init__(vfs=server.vfs)
+        self.server = server
+        self.writer = writer
+        self.cancel_event = threading.Event()
+        self.pending = None  # задача текущего запроса
+    
+    async def send(self, message):
+        self.writer.write((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+        await self.writer.drain()
+    
+    def print_output(self, text):
+        # Вызывается в потоке команды: ждем отправки, чтобы медленный клиент не копил вывод в памяти сервера
+        self.check_cancelled()
+        asyncio.run_coroutine_threadsafe(self.send({'output': text}), self.server.loop).result()
+    
+    def check_reload(self):
+        pass  # изменения CSV применяет сервер под блокировкой записи
+    
+    def on_exit(self):
+        pass  # общая VFS закрывается вместе с сервером
+
+class VFSServer:
+    """Сервер VFS на Unix-сокете: загружает VFS один раз и выполняет команды и запросы многих клиентов.
+    Протокол - JSON по строке на сообщение"""
+    OPERATIONS = {'get_node', 'list_directory', 'read_file', 'change_owner', 'complete_names'}
+    
+    def __init__(self, vfs, socket_path, workers=DEFAULT_SERVER_WORKERS):
+        self.vfs = SharedVFS(vfs)
+        self.socket_path = socket_path
+        self.lock = ReadWriteLock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='session')
+        self.loop = None
+        self.sessions = set()
+    
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # сокет от прошлого запуска
+        server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+        stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, stopping.set)
+        background = [asyncio.create_task(self.journal_task())]
+        if self.vfs.watch_path:
+            background.append(asyncio.create_task(self.reload_task()))
+        try:
+            async with server:
+                await stopping.wait()
+                await self.stop_sessions()
+        finally:
+            for task in background:
+                task.cancel()
+            # Ожидание потоков - вне цикла событий: им может понадобиться цикл, чтобы завершиться
+            await asyncio.to_thread(self.executor.shutdown, wait=True, cancel_futures=True)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+    
+    async def stop_sessions(self):
+        """Прерывает команды всех сеансов и дожидается их завершения.
+        Соединения обрываются: поток, ждущий отправки вывода клиенту, который его не читает,
+        иначе не завершится"""
+        for session in self.sessions:
+            session.cancel_event.set()
+            session.writer.transport.abort()
+        pending = [session.pending for session in self.sessions if session.pending is not None]
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    async def journal_task(self):
+        """Сбрасывает накопившиеся записи журнала, как journal_tick в окне"""
+        while True:
+            await asyncio.sleep(JOURNAL_GROUP_MS / 1000)
+            if self.vfs.journal is not None:
+                with self.vfs.mutex:
+                    self.vfs.journal.flush()
+    
+    async def reload_task(self):
+        """Применяет изменения CSV при --watch, не пуская в это время команды"""
+        while True:
+            await asyncio.sleep(RELOAD_POLL_MS / 1000)
+            async with self.lock.write():
+                snapshots = len(self.vfs.checkpoints)
+                result = await self.loop.run_in_executor(self.executor, self.vfs.reload_if_changed)
+            if result and result != (0, 0):
+                print(f"VFS обновлена: строк добавлено/изменено {result[0]}, удалено {result[1]}", file=sys.stderr)
+                if snapshots:
+                    print(f"Снимки ({snapshots}) удалены: откатить изменения CSV нельзя", file=sys.stderr)
+    
+    async def handle_client(self, reader, writer):
+        session = ServerSession(self, writer)
+        self.sessions.add(session)
+        try:
+            await session.send({'hello': session.hostname, 'cwd': session.current_dir})
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line)
+                if request.get('op') == 'cancel':
+                    session.cancel_event.set()
+                elif session.pending is not None and not session.pending.done():
+                    await session.send({'error': 'предыдущий запрос еще выполняется'})
+                else:
+                    session.pending = asyncio.create_task(self.dispatch(session, request))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            session.cancel_event.set()
+            if session.pending is not None:
+                await asyncio.gather(session.pending, return_exceptions=True)
+            writer.close()
+    
+    async def dispatch(self, session, request):
+        op = request.get('op')
+        try:
+            if op == 'command':
+                line = request.get('line', '')
+                session.cancel_event.clear()
+                lock = self.lock.write if command_writes(line) else self.lock.read
+                async with lock():
+                    await self.loop.run_in_executor(self.executor, session.execute_single_command, line)
+                await session.send({'done': True, 'cwd': session.current_dir, 'running': session.running})
+            elif op in self.OPERATIONS:
+                args = list(request.get('args', []))
+                if args and not args[0].startswith('/'):
+                    args[0] = session.resolve_path(args[0])
+                lock = self.lock.write if op == 'change_owner' else self.lock.read
+                async with lock():
+                    result = await self.loop.run_in_executor(self.executor, self.call, op, args)
+                await session.send({'result': result})
+            else:
+                await session.send({'error': f"неизвестный запрос: {op}"})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            await session.send({'error': str(e)})
+    
+    def call(self, op, args):
+        """Выполняет запрос к VFS и приводит ответ к виду, пригодному для JSON"""
+        if op == 'get_node':
+            node = self.vfs.get_node(*args)
+            if node is None:
+                return None
+            owner, group = self.vfs.owner_of(node)
+            return {'name': node.name, 'path': self.vfs.path_of(node), 'is_directory': node.is_directory,
+                    'owner': owner, 'group': group}
+        return getattr(self.vfs, op)(*args)
+
+class VFSClient:
+    """Блокирующий клиент сервера VFS; используется тонким клиентом Shell (--connect)"""
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.buffer = bytearray()
+        hello = self.receive()
+        self.current_dir = hello['cwd']
+    
+    def send(self, message):
+        self.sock.sendall((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+    
+    def receive(self, timeout=None):
+        """Следующее сообщение сервера; None, если за timeout секунд оно не пришло"""
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 1]
+                return json.loads(line)
+            if timeout is not None and not select.select([self.sock], [], [], timeout)[0]:
+                return None
+            data = self.sock.recv(READ_CHUNK_SIZE)
+            if not data:
+                raise ConnectionError('сервер VFS закрыл соединение')
+            self.buffer += data
+    
+    def request(self, op, *args):
+        self.send({'op': op, 'args': args})
+        message = self.receive()
+        if 'error' in message:
+            raise RuntimeError(message['error'])
+        return message['result']
+    
+    def get_node(self, path):
+        return self.request('get_node', path)
+    
+    def list_directory(self, path):
+        return self.request('list_directory', path)
+    
+    def read_file(self, path):
+        return self.request('read_file', path)
+    
+    def change_owner(self, path, owner, group=None, recursive=False):
+        return self.request('change_owner', path, owner, group, recursive)
+    
+    def complete_names(self, path, prefix='', limit=None):
+        return self.request('complete_names', path, prefix, limit)
+    
+    def close(self):
+        self.sock.close()
+
+def serve(args):
+    """Загружает VFS и обслуживает клиентов до Ctrl-C или SIGTERM"""
+    vfs = VFS(args.vfs, load_workers=args.load_workers, journal=args.journal, watch=args.watch, lazy=args.lazy)
+    server = VFSServer(vfs, args.serve)
+    print(f"Сервер VFS слушает {args.serve}", file=sys.stderr)
+    try:
+        asyncio.run(server.serve())
+    finally:
+        vfs.close()
+
 def main():
     parser = argparse.ArgumentParser(description='Эмулятор терминала с поддержкой VFS и стартового скрипта')
-    parser.add_argument('--vfs', help='Путь к физическому расположению VFS (CSV файл)')
+    parser.add_argument('--vfs', help='Путь к физическому расположению VFS (CSV файл или бинарный образ)')
     parser.add_argument('--script', help='Путь к стартовому скрипту')
+    parser.add_argument('--output-latency', type=int, default=DEFAULT_OUTPUT_LATENCY_MS, metavar='MS',
+                        help='Максимальная задержка вывода в окно в миллисекундах (0 - при простое)')
+    parser.add_argument('--scrollback', type=int, default=DEFAULT_SCROLLBACK_LINES, metavar='LINES',
+                        help='Сколько строк вывода хранить в окне (0 - без ограничения)')
+    parser.add_argument('--transcript', metavar='FILE', help='Файл, в который дописываются вытесненные из окна строки')
+    parser.add_argument('--script-slice', type=int, default=DEFAULT_SCRIPT_SLICE_MS, metavar='MS',
+                        help='Сколько миллисекунд за тик окна выполнять скрипт')
+    # Пул разбирает только строки CSV, узлы строит основной процесс - выигрыш не больше ~2 раз, поэтому пул по запросу
+    parser.add_argument('--load-workers', type=int, default=1, metavar='N',
+                        help='Число процессов для разбора больших CSV (по умолчанию 1 - без пула)')
+    parser.add_argument('--journal', action='store_true',
+                        help='Сохранять изменения VFS в журнал рядом с образом (<vfs>.journal) и применять его при запуске')
+    parser.add_argument('--watch', action='store_true',
+                        help='Следить за изменениями CSV из --vfs и применять их без перезапуска')
+    parser.add_argument('--lazy', action='store_true',
+                        help='Строить директории CSV по мере обращения, используя индекс-спутник <vfs>.idx')
+    parser.add_argument('--command-timeout', type=float, default=DEFAULT_COMMAND_TIMEOUT_S, metavar='SEC',
+                        help='Сколько секунд может выполняться команда в окне (0 - без ограничения)')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help='При выходе вывести гистограммы времени команд в FILE (по умолчанию в stderr)')
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help='Загрузить --vfs один раз и обслуживать клиентов через Unix-сокет SOCKET')
+    parser.add_argument('--connect', metavar='SOCKET',
+                        help='Работать тонким клиентом сервера VFS (--serve) вместо загрузки --vfs')
+    parser.add_argument('--headless', action='store_true',
+                        help='Работать без окна: выполнить --script (или команды из stdin) с выводом в stdout')
+    parser.add_argument('--compile', metavar='IMAGE', help='Преобразовать CSV из --vfs в бинарный образ и выйти')
     
     args = parser.parse_args()
     
+    if args.compile:
+        if not args.vfs:
+            parser.error('--compile требует --vfs')
+        count = compile_image(args.vfs, args.compile, args.load_workers)
+        print(f"Образ VFS записан в {args.compile} ({count} узлов)")
+        return
+    
+    if args.serve:
+        if not args.vfs:
+            parser.error('--serve требует --vfs')
+        serve(args)
+        return
+    
+    if args.headless:
+        HeadlessTerminal(args.vfs, args.script, load_workers=args.load_workers, journal=args.journal,
+                         watch=args.watch, lazy=args.lazy, profile=args.profile, connect=args.connect).run()
+        return
+    
+    import tkinter as tk
     root = tk.Tk()
     root.geometry("1000x1000")
     root.minsize(600, 400)
     
-    app = TerminalEmulator(root, args.vfs, args.script)
+    app = TerminalEmulator(root, args.vfs, args.script, output_latency_ms=args.output_latency,
+                           scrollback_lines=args.scrollback, transcript_path=args.transcript,
+                           script_slice_ms=args.script_slice, load_workers=args.load_workers, journal=args.journal,
+                           watch=args.watch, lazy=args.lazy, profile=args.profile,
+                           command_timeout=args.command_timeout, connect=args.connect)
     root.mainloop()
 
 if __name__ == "__main__":
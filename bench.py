@@ -0,0 +1,150 @@
+import os
+import sys
+import io
+import csv
+import json
+import time
+import base64
+import random
+import argparse
+import tempfile
+import platform
+
+from Pract5 import VFS, HeadlessTerminal
+
+def generate_vfs_csv(csv_path, depth=3, fanout=4, files_per_dir=10, content_size=256, seed=0):
+    """Генерирует CSV-описание VFS: дерево директорий глубины depth с fanout поддиректориями"""
+    rng = random.Random(seed)
+    directories = []
+    files = []
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'type', 'content'])
+        level = ['']
+        for _ in range(depth):
+            next_level = []
+            for parent in level:
+                for i in range(fanout):
+                    path = f"{parent}/dir{i}"
+                    writer.writerow([path, 'directory', ''])
+                    directories.append(path)
+                    next_level.append(path)
+            level = next_level
+        for directory in [''] + directories:
+            for i in range(files_per_dir):
+                path = f"{directory}/file{i}.txt"
+                lines = []
+                size = 0
+                while size < content_size:
+                    line = ''.join(rng.choice('abcdefghij ') for _ in range(40))
+                    lines.append(line)
+                    size += len(line) + 1
+                content = '\n'.join(lines)[:content_size]
+                writer.writerow([path, 'file', base64.b64encode(content.encode('utf-8')).decode('ascii')])
+                files.append(path)
+    return directories, files
+
+def measure(name, func, repeat, params):
+    """Выполняет func repeat раз и возвращает запись с результатами"""
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    for _ in range(repeat):
+        func()
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+    return {
+        'benchmark': name,
+        'repeat': repeat,
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'per_op_us': wall / repeat * 1e6,
+        'params': params,
+    }
+
+def run_benchmarks(args):
+    params = {
+        'depth': args.depth,
+        'fanout': args.fanout,
+        'files_per_dir': args.files_per_dir,
+        'content_size': args.content_size,
+    }
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'bench.csv')
+        directories, files = generate_vfs_csv(csv_path, args.depth, args.fanout, args.files_per_dir,
+                                              args.content_size, args.seed)
+        params['directories'] = len(directories)
+        params['files'] = len(files)
+        params['csv_bytes'] = os.path.getsize(csv_path)
+
+        # Отладочный вывод VFS идет в stderr - на время измерений глушим его
+        real_stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            results.append(measure('load_from_csv', lambda: VFS(csv_path), args.load_repeat, params))
+            vfs = VFS(csv_path)
+
+            rng = random.Random(args.seed)
+            deep_dirs = [d for d in directories if d.count('/') == args.depth] or ['/']
+            sample_files = [rng.choice(files) for _ in range(args.ops)]
+            sample_dirs = [rng.choice(deep_dirs) for _ in range(args.ops)]
+
+            def cycle(items, func):
+                iterator = iter(items * (args.ops // len(items) + 1))
+                return lambda: func(next(iterator))
+
+            results.append(measure('get_node', cycle(sample_files, vfs.get_node), args.ops, params))
+            results.append(measure('list_directory', cycle(sample_dirs, vfs.list_directory), args.ops, params))
+            results.append(measure('read_file', cycle(sample_files, vfs.read_file), args.ops, params))
+            results.append(measure('change_owner', cycle(sample_files, lambda p: vfs.change_owner(p, 'bench', 'bench')),
+                                   args.ops, params))
+
+            shell = HeadlessTerminal(None, output=io.StringIO())
+            shell.current_dir = deep_dirs[0]
+            relative = ['..', '../..', '.', 'file0.txt', '../dir0/file1.txt']
+            results.append(measure('resolve_path', cycle(relative, shell.resolve_path), args.ops, params))
+            shell.vfs = vfs
+            prefixes = [f"cat {path[:len(path) - 5]}" for path in sample_files]
+            results.append(measure('complete', cycle(prefixes, shell.complete), args.ops, params))
+
+            script_path = os.path.join(tmp, 'bench_script.txt')
+            with open(script_path, 'w', encoding='utf-8') as f:
+                for i in range(args.script_lines):
+                    directory = sample_dirs[i % len(sample_dirs)]
+                    file_path = sample_files[i % len(sample_files)]
+                    f.write(f"cd {directory}\nls\ncat {file_path}\nrev {file_path}\nchown bench:bench {file_path}\n")
+
+            def replay():
+                replay_shell = HeadlessTerminal(None, output=io.StringIO())
+                replay_shell.vfs = vfs
+                replay_shell.execute_script(script_path)
+            results.append(measure('script_replay', replay, 1, dict(params, script_commands=args.script_lines * 5)))
+        finally:
+            sys.stderr = real_stderr
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры производительности эмулятора на синтетической VFS')
+    parser.add_argument('--depth', type=int, default=3, help='Глубина дерева директорий')
+    parser.add_argument('--fanout', type=int, default=8, help='Число поддиректорий в каждой директории')
+    parser.add_argument('--files-per-dir', type=int, default=20, help='Число файлов в каждой директории')
+    parser.add_argument('--content-size', type=int, default=1024, help='Размер содержимого файла в символах')
+    parser.add_argument('--ops', type=int, default=20000, help='Число операций в точечных замерах')
+    parser.add_argument('--load-repeat', type=int, default=3, help='Сколько раз загружать CSV')
+    parser.add_argument('--script-lines', type=int, default=2000, help='Число групп команд в сценарии')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Файл для результатов (JSON Lines), по умолчанию stdout')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    meta = {'python': platform.python_version(), 'platform': platform.platform(), 'timestamp': time.time()}
+    out = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for result in results:
+            out.write(json.dumps(dict(result, **meta), ensure_ascii=False) + '\n')
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import base64
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Pract5 import decode_content
+
+
+class DecodeContentTest(unittest.TestCase):
+    def test_base64(self):
+        self.assertEqual(decode_content(base64.b64encode('Привет мир'.encode('utf-8'))), 'Привет мир')
+
+    def test_plain_text_falls_back(self):
+        self.assertEqual(decode_content('Привет мир'.encode('utf-8')), 'Привет мир')
+        self.assertEqual(decode_content(b'hello'), 'hello')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Pract5
+from Pract5 import VFS, Journal
+
+
+def state(vfs):
+    """Дерево VFS в виде {путь: (директория ли, содержимое, владелец, группа)}"""
+    result = {}
+    stack = [('/', vfs.root)]
+    while stack:
+        path, node = stack.pop()
+        content = None if node.is_directory else vfs.read_file(path)
+        result[path] = (node.is_directory, content) + vfs.owner_of(node)
+        if node.is_directory:
+            for name, child in vfs.children_of(node).items():
+                stack.append((path.rstrip('/') + '/' + name, child))
+    return result
+
+
+def change(vfs, step):
+    """Набор изменений, затрагивающий все виды записей журнала"""
+    vfs.create_directory(f'/new{step}')
+    vfs.create_file(f'/new{step}/f.txt', f'text {step}')
+    vfs.append_content(vfs.get_node('/d/a.txt'), f' +{step}')
+    vfs.write_file_chunks('/d/b.txt', iter([f'replaced {step}']))
+    vfs.change_owner('/d', f'user{step}', 'staff', recursive=True)
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.csv_path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            f.write('path,type,content\n/d,directory,\n/d/a.txt,file,old\n/d/b.txt,file,b\n/c.txt,file,c\n')
+        self.journal_path = self.csv_path + '.journal'
+        self.addCleanup(os.unlink, self.csv_path)
+        self.addCleanup(lambda: os.path.exists(self.journal_path) and os.unlink(self.journal_path))
+
+    def force_compaction(self, records):
+        compact_records = Pract5.JOURNAL_COMPACT_RECORDS
+        Pract5.JOURNAL_COMPACT_RECORDS = records
+        self.addCleanup(setattr, Pract5, 'JOURNAL_COMPACT_RECORDS', compact_records)
+
+    def reopen(self, vfs):
+        before = state(vfs)
+        vfs.close()
+        reopened = VFS(self.csv_path, journal=True)
+        self.addCleanup(reopened.close)
+        self.assertEqual(state(reopened), before)
+        return reopened
+
+    def test_reopen_restores_state(self):
+        vfs = VFS(self.csv_path, journal=True)
+        for step in range(3):
+            change(vfs, step)
+        self.reopen(vfs)
+
+    def test_reopen_after_snapshot_and_rollback(self):
+        vfs = VFS(self.csv_path, journal=True)
+        change(vfs, 0)
+        vfs.snapshot()
+        change(vfs, 1)
+        self.assertTrue(vfs.rollback())
+        change(vfs, 2)
+        self.reopen(vfs)
+
+    def test_reopen_after_compaction(self):
+        self.force_compaction(10)
+        vfs = VFS(self.csv_path, journal=True)
+        change(vfs, 0)
+        for step in range(100):
+            vfs.change_owner('/d', f'user{step}')  # повторные изменения тех же узлов сжимаются
+        vfs.journal.flush()
+        self.assertLess(sum(1 for _ in Journal.read(self.journal_path)), 30)
+        self.reopen(vfs)
+
+    def test_compacted_journal_larger_than_threshold(self):
+        self.force_compaction(10)
+        vfs = VFS(self.csv_path, journal=True)
+        rewrites = []
+        rewrite = vfs.journal.rewrite
+        vfs.journal.rewrite = lambda records: (rewrites.append(len(records)), rewrite(records))
+        for step in range(100):
+            vfs.create_file(f'/f{step}.txt', 'x')
+        self.assertLess(len(rewrites), 10)
+        self.reopen(vfs)
+
+    def test_snapshot_survives_compaction_threshold(self):
+        self.force_compaction(10)
+        vfs = VFS(self.csv_path, journal=True)
+        saved = state(vfs)
+        vfs.snapshot()
+        for step in range(10):
+            change(vfs, step)
+        self.assertTrue(vfs.rollback())
+        self.assertEqual(state(vfs), saved)
+        reopened = self.reopen(vfs)
+        # При запуске разросшийся журнал сжимается
+        self.assertEqual(state(reopened), saved)
+        self.assertLess(reopened.journal.records, 10)
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.csv_path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            f.write('path,type,content\n/d,directory,\n/d/a.txt,file,a\n/d/b.txt,file,b\n')
+            f.write(''.join(f'/d/file{i:03}.txt,file,{i}\n' for i in range(200)))
+        self.addCleanup(os.unlink, self.csv_path)
+        self.vfs = VFS(self.csv_path)
+
+    def views(self):
+        vfs = self.vfs
+        return (state(vfs), vfs.find('/', '*.txt'), vfs.find('/', 'file007.txt'),
+                vfs.complete_names('/d', 'file0', 1000), vfs.complete_names('/', ''),
+                vfs.list_directory('/'), vfs.list_directory('/d'))
+
+    def test_rollback_restores_tree_and_indexes(self):
+        before = self.views()
+        self.vfs.snapshot()
+        change(self.vfs, 0)
+        self.vfs.remove_node('/d/file007.txt')
+        self.vfs.create_file('/d/file007.txt', 'recreated')
+        self.vfs.create_file('/d/file0new.txt', 'new')
+        self.vfs.remove_node('/d/file050.txt')
+        self.assertNotEqual(self.views(), before)
+        self.assertTrue(self.vfs.rollback())
+        self.assertEqual(self.views(), before)
+
+    def test_rollback_to_earlier_snapshot(self):
+        before = self.views()
+        first = self.vfs.snapshot()
+        change(self.vfs, 0)
+        middle = self.views()
+        self.vfs.snapshot()
+        change(self.vfs, 1)
+        self.vfs.remove_node('/d')
+        self.assertTrue(self.vfs.rollback(first))
+        self.assertEqual(self.views(), before)
+        self.assertFalse(self.vfs.rollback(2))
+        change(self.vfs, 0)
+        self.assertEqual(self.views(), middle)
+        self.assertTrue(self.vfs.rollback())
+        self.assertEqual(self.views(), before)
+
+    def test_insert_remembers_only_the_name(self):
+        self.vfs.snapshot()
+        self.vfs.create_file('/d/extra.txt', 'x')
+        self.assertEqual(self.vfs.undo_log, [(self.vfs.get_node('/d'), 'child', ('extra.txt', None))])
+
+
+if __name__ == '__main__':
+    unittest.main()
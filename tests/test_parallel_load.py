@@ -0,0 +1,61 @@
+import base64
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Pract5 import VFS
+
+
+def tree(vfs):
+    """Дерево VFS по порядку детей: [(путь, директория ли, содержимое)]"""
+    result = []
+    stack = [('/', vfs.root)]
+    while stack:
+        path, node = stack.pop()
+        result.append((path, node.is_directory, None if node.is_directory else vfs.read_file(path)))
+        if node.is_directory:
+            children = list(vfs.children_of(node).items())
+            stack.extend((path.rstrip('/') + '/' + name, child) for name, child in reversed(children))
+    return result
+
+
+class ParallelLoadTest(unittest.TestCase):
+    def write_csv(self, rows, newline='\n'):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w', encoding='utf-8', newline='') as f:
+            f.write(newline.join(['path,type,content'] + rows) + newline)
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def rows(self):
+        rows = []
+        for d in range(20):
+            rows.append(f'/dir{d},directory,')
+            for i in range(50):
+                content = base64.b64encode(f'файл {d}/{i}'.encode('utf-8')).decode('ascii')
+                rows.append(f'/dir{d}/f{i}.txt,file,{content}')
+            rows.append(f'/implicit{d}/deep/x.txt,file,')
+        rows.append('/dir0/f0.txt,file,0LLRgtC+0YDQsNGP')  # повтор пути: побеждает последняя строка
+        return rows
+
+    def assert_parallel_matches_serial(self, csv_path):
+        serial = VFS(csv_path, load_workers=1)
+        parallel = VFS()
+        self.assertTrue(parallel.load_from_csv_parallel(csv_path, 4))
+        self.assertEqual(tree(parallel), tree(serial))
+
+    def test_parallel_matches_serial(self):
+        self.assert_parallel_matches_serial(self.write_csv(self.rows()))
+
+    def test_crlf_rows(self):
+        self.assert_parallel_matches_serial(self.write_csv(self.rows(), '\r\n'))
+
+    def test_quoted_csv_falls_back(self):
+        csv_path = self.write_csv(['/a.txt,file,"x,\ny"'])
+        self.assertFalse(VFS().load_from_csv_parallel(csv_path, 4))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Pract5 import reverse_lines
+
+
+def split_chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class ReverseLinesTest(unittest.TestCase):
+    def test_matches_split(self):
+        for text in ['', 'abc', 'ab\ncd', 'ab\ncd\n', '\n\nxyz\n', 'a' * 50 + '\n' + 'b' * 30]:
+            expected = ''.join(line[::-1] + '\n' for line in text.split('\n'))
+            for size in (1, 3, 7, 100):
+                self.assertEqual(''.join(reverse_lines(split_chunks(text, size), batch_size=4)), expected)
+
+    def test_without_empty_tail(self):
+        self.assertEqual(''.join(reverse_lines(['ab\n', 'cd\n'], empty_tail=False)), 'ba\ndc\n')
+
+    def test_long_line_across_chunks(self):
+        text = ''.join(chr(ord('a') + i % 26) for i in range(10000))
+        self.assertEqual(''.join(reverse_lines(split_chunks(text, 64))), text[::-1] + '\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
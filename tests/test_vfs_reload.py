@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import io
+
+from Pract5 import VFS, HeadlessTerminal
+
+
+def dump(vfs):
+    """Дерево VFS в виде {путь: (директория ли, содержимое)}"""
+    result = {}
+    stack = [('/', vfs.root)]
+    while stack:
+        path, node = stack.pop()
+        result[path] = (node.is_directory, None if node.is_directory else vfs.read_file(path))
+        if node.is_directory:
+            for name, child in vfs.children_of(node).items():
+                stack.append((path.rstrip('/') + '/' + name, child))
+    return result
+
+
+class ReloadTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.csv_path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+
+    def tearDown(self):
+        os.unlink(self.csv_path)
+
+    def write_csv(self, lines):
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write('path,type,content\n' + '\n'.join(lines) + '\n')
+        # Сигнатура - mtime и размер: сдвигаем mtime, чтобы изменение заметили даже при том же размере
+        stat = os.stat(self.csv_path)
+        os.utime(self.csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def assert_reload_matches(self, before, after):
+        self.write_csv(before)
+        vfs = VFS(self.csv_path, watch=True)
+        self.write_csv(after)
+        self.assertIsNotNone(vfs.reload_if_changed())
+        self.assertEqual(dump(vfs), dump(VFS(self.csv_path)))
+        self.assertIsNone(vfs.reload_if_changed())
+
+    def test_added_and_changed_files(self):
+        self.assert_reload_matches(['/a.txt,file,one', '/d,directory,'],
+                                   ['/a.txt,file,two', '/d,directory,', '/d/b.txt,file,new'])
+
+    def test_prunes_implicit_parents(self):
+        self.assert_reload_matches(['/keep.txt,file,k', '/x/y/z.txt,file,deep'], ['/keep.txt,file,k'])
+
+    def test_keeps_parent_with_other_children(self):
+        self.assert_reload_matches(['/x/y/z.txt,file,1', '/x/w.txt,file,2'], ['/x/w.txt,file,2'])
+
+    def test_removed_directory_stays_while_implicitly_needed(self):
+        self.assert_reload_matches(['/d,directory,', '/d/f.txt,file,1'], ['/d/f.txt,file,1'])
+
+    def test_file_becomes_directory(self):
+        self.assert_reload_matches(['/a,file,x'], ['/a/b.txt,file,y', '/a,directory,'])
+
+    def test_directory_becomes_file(self):
+        self.assert_reload_matches(['/a,directory,', '/a/b.txt,file,y'], ['/a,file,x'])
+
+    def test_column_order_change(self):
+        self.write_csv(['/a.txt,file,one'])
+        vfs = VFS(self.csv_path, watch=True)
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write('type,path,content\nfile,/b.txt,two\n')
+        stat = os.stat(self.csv_path)
+        os.utime(self.csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        vfs.reload_if_changed()
+        self.assertEqual(dump(vfs), dump(VFS(self.csv_path)))
+
+    def test_failed_reload_is_retried(self):
+        self.write_csv(['/a.txt,file,one'])
+        vfs = VFS(self.csv_path, watch=True)
+        self.write_csv(['/a.txt,file,two'])
+        add_entry = vfs.add_entry
+        def failing(*args):
+            raise OSError('disk full')
+        vfs.add_entry = failing
+        with self.assertRaises(OSError):
+            vfs.reload_if_changed()
+        vfs.add_entry = add_entry
+        self.assertIsNotNone(vfs.reload_if_changed())
+        self.assertEqual(dump(vfs), dump(VFS(self.csv_path)))
+
+    def test_contents_not_kept(self):
+        self.write_csv(['/a.txt,file,' + 'secret' * 100])
+        vfs = VFS(self.csv_path, watch=True)
+        self.assertNotIn('secret', repr(vfs.watch_rows))
+
+    def test_dropped_snapshots_reported(self):
+        self.write_csv(['/a.txt,file,one'])
+        output = io.StringIO()
+        shell = HeadlessTerminal(self.csv_path, output=output, watch=True)
+        shell.vfs.snapshot()
+        self.write_csv(['/a.txt,file,two'])
+        shell.check_reload()
+        self.assertIn('Снимки (1) удалены', output.getvalue())
+        self.assertEqual(shell.vfs.checkpoints, [])
+
+
+if __name__ == '__main__':
+    unittest.main()